@@ -1,10 +1,19 @@
-import csv
+import argparse
+import gc
+import json
+import math
+import multiprocessing
 import sys
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
 
-from util import Node, StackFrontier, QueueFrontier
+from graph import Graph
+from landmarks import LandmarkOracle
+from util import LRUCache, NameIndex, Node, SearchTree, read_rows
 
-# Maps names to a set of corresponding person_ids
-names = {}
+# Sorted index of lowercase names to person_ids
+names = NameIndex()
 
 # Maps person_ids to a dictionary of: name, birth, movies (a set of movie_ids)
 people = {}
@@ -12,55 +21,121 @@ people = {}
 # Maps movie_ids to a dictionary of: title, year, stars (a set of person_ids)
 movies = {}
 
+# Compact integer-indexed graph, used instead of the dicts above
+# when the data was loaded with compact=True
+graph = None
 
-def load_data(directory):
+# Landmark distance oracle over the compact graph, if one was loaded
+oracle = None
+
+# Number of single-source search trees kept, and how many queries from
+# the same source it takes before its tree is built
+TREE_CACHE_SIZE = 16
+HUB_QUERIES = 3
+
+# Most people reached by all cached trees together when the dicts above
+# are loaded: each costs a couple of dict entries there, while the trees
+# of the compact graph are flat arrays and only count towards the size
+TREE_CACHE_PEOPLE = 1_000_000
+
+# Maps source person_ids to their full breadth-first search tree
+trees = LRUCache(TREE_CACHE_SIZE, TREE_CACHE_PEOPLE,
+                 lambda tree: len(tree) if isinstance(tree, SearchTree) else 0)
+
+# Number of recent source person_ids whose queries are counted
+SOURCE_COUNTS_SIZE = 4096
+
+# Counts answered queries per recent source person_id
+source_counts = LRUCache(SOURCE_COUNTS_SIZE)
+
+# Most prefix matches offered when a name has no exact match
+PREFIX_MATCHES = 10
+
+
+def load_data(directory, compact=False, landmarks=0):
     """
     Load data from CSV files into memory.
+
+    If `compact` is true, the data is loaded into a `Graph` instead,
+    and the search functions below run directly on it. The graph is
+    read from a snapshot file next to the CSVs when one is up to date.
+    With `landmarks`, a distance oracle using that many landmark people
+    is also loaded (or built) for the compact graph.
     """
-    # Load people
-    with open(f"{directory}/people.csv", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            people[row["id"]] = {
-                "name": row["name"],
-                "birth": row["birth"],
-                "movies": set()
-            }
-            if row["name"].lower() not in names:
-                names[row["name"].lower()] = {row["id"]}
-            else:
-                names[row["name"].lower()].add(row["id"])
+    global graph, oracle
+    trees.clear()
+    source_counts.clear()
+    oracle = None
+    if compact or landmarks:
+        graph = Graph.open(directory)
+        if landmarks:
+            oracle = LandmarkOracle.open(graph, directory, landmarks)
+        return
+    graph = None
+    names.clear()
+    people.clear()
+    movies.clear()
+
+    # Load people, one row at a time
+    for person_id, name, birth in read_rows(f"{directory}/people.csv", "id", "name", "birth"):
+        people[person_id] = {
+            "name": name,
+            "birth": birth,
+            "movies": set()
+        }
+        names.add(name, person_id)
+    names.sort()
 
     # Load movies
-    with open(f"{directory}/movies.csv", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            movies[row["id"]] = {
-                "title": row["title"],
-                "year": row["year"],
-                "stars": set()
-            }
+    for movie_id, title, year in read_rows(f"{directory}/movies.csv", "id", "title", "year"):
+        movies[movie_id] = {
+            "title": title,
+            "year": year,
+            "stars": set()
+        }
 
     # Load stars
-    with open(f"{directory}/stars.csv", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            try:
-                people[row["person_id"]]["movies"].add(row["movie_id"])
-                movies[row["movie_id"]]["stars"].add(row["person_id"])
-            except KeyError:
-                pass
+    for person_id, movie_id in read_rows(f"{directory}/stars.csv", "person_id", "movie_id"):
+        try:
+            people[person_id]["movies"].add(movie_id)
+            movies[movie_id]["stars"].add(person_id)
+        except KeyError:
+            pass
 
 
 def main():
-    if len(sys.argv) > 2:
-        sys.exit("Usage: python degrees.py [directory]")
-    directory = sys.argv[1] if len(sys.argv) == 2 else "large"
+    parser = argparse.ArgumentParser(prog="python degrees.py")
+    parser.add_argument("directory", nargs="?", default="large")
+    parser.add_argument("--compact", action="store_true",
+                        help="load the data into a compact integer graph")
+    parser.add_argument("--landmarks", metavar="K", type=int, default=0,
+                        help="use a distance oracle with K landmarks (implies --compact)")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="answer tab-separated name pairs from FILE ('-' for stdin)")
+    parser.add_argument("--workers", metavar="N", type=int, default=1,
+                        help="number of processes answering batch queries")
+    parser.add_argument("--serve", metavar="PORT", type=int,
+                        help="keep the data loaded and answer queries over HTTP")
+    args = parser.parse_args()
+
+    # Keep stdout for answers when they are meant to be parsed
+    log = sys.stderr if args.batch is not None or args.serve is not None else sys.stdout
 
     # Load data from files into memory
-    print("Loading data...")
-    load_data(directory)
-    print("Data loaded.")
+    print("Loading data...", file=log)
+    load_data(args.directory, compact=args.compact, landmarks=args.landmarks)
+    print("Data loaded.", file=log)
+
+    if args.batch is not None:
+        if args.batch == "-":
+            run_batch(sys.stdin, sys.stdout, args.workers)
+        else:
+            with open(args.batch, encoding="utf-8") as f:
+                run_batch(f, sys.stdout, args.workers)
+        return
+    if args.serve is not None:
+        serve(args.serve)
+        return
 
     source = person_id_for_name(input("Name: "))
     if source is None:
@@ -69,7 +144,7 @@ def main():
     if target is None:
         sys.exit("Person not found.")
 
-    path = shortest_path(source, target)
+    path = bidirectional_shortest_path(source, target)
 
     if path is None:
         print("Not connected.")
@@ -78,9 +153,9 @@ def main():
         print(f"{degrees} degrees of separation.")
         path = [(None, source)] + path
         for i in range(degrees):
-            person1 = people[path[i][1]]["name"]
-            person2 = people[path[i + 1][1]]["name"]
-            movie = movies[path[i + 1][0]]["title"]
+            person1 = get_person(path[i][1])["name"]
+            person2 = get_person(path[i + 1][1])["name"]
+            movie = get_movie(path[i + 1][0])["title"]
             print(f"{i + 1}: {person1} and {person2} starred in {movie}")
 
 
@@ -91,56 +166,200 @@ def shortest_path(source, target):
 
     If no possible path, returns None.
     """
+    if graph is not None:
+        return graph.shortest_path(source, target)
 
-    # TODO
+    if source == target:
+        return []
 
-    root = Node((None, source), None, neighbors_for_person(source))
-    explored = set()
-    frontier = QueueFrontier()
-    frontier.add(root)
+    # Neighbors are only looked up when a node is expanded, so nodes that
+    # are still in the frontier when the target is found cost nothing more
+    root = Node((None, source), None, None)
+    reached = {source}
+    # A movie's cast is scanned at most once: everyone in it is reached
+    # the first time, and later scans could only find longer paths
+    scanned_movies = set()
+    # `reached` already keeps states out of the frontier twice, so a
+    # plain queue is enough
+    frontier = deque([root])
 
     def getPath(node):
         path = []
         while (node.parent) :
-            print(path)
             path += [(node.state)]
             node = node.parent
 
         path.reverse()
         return path
 
-    while not frontier.empty():
-        node = frontier.remove()
-        if node.state[1] == target:
-            return getPath(node)
-
-        explored.add(node.state)
+    while frontier:
+        node = frontier.popleft()
 
         # expand
-        for neighbor in node.action:
-            # skip if already visited or if state(neighbor) already added in frontier
-            if (neighbor in explored or frontier.contains_state(neighbor)):
+        for movie_id in people[node.state[1]]["movies"]:
+            if movie_id in scanned_movies:
                 continue
-            new_node = Node(neighbor, node, neighbors_for_person(neighbor[1])) 
-            frontier.add(new_node)
+            scanned_movies.add(movie_id)
+            for person_id in movies[movie_id]["stars"]:
+                if person_id in reached:
+                    continue
+                reached.add(person_id)
+                new_node = Node((movie_id, person_id), node, None)
+                # test the goal as soon as it is generated
+                if person_id == target:
+                    return getPath(new_node)
+                frontier.append(new_node)
 
         # repeat
     # no solution
     return None
 
 
+def bidirectional_shortest_path(source, target):
+    """
+    Returns the shortest list of (movie_id, person_id) pairs
+    that connect the source to the target, growing one breadth-first
+    search from the source and another from the target until they meet.
+
+    If no possible path, returns None.
+    """
+    if graph is not None:
+        return graph.shortest_path(source, target)
+    if source == target:
+        return []
+
+    # Maps each reached person_id to the (movie_id, person_id) step
+    # leading back towards the side it was reached from
+    forward = {source: None}
+    backward = {target: None}
+    forward_layer = [source]
+    backward_layer = [target]
+    # Movies whose cast each side has already scanned
+    forward_movies = set()
+    backward_movies = set()
+
+    while forward_layer and backward_layer:
+        # always grow the smaller side, it touches fewer people
+        if len(forward_layer) <= len(backward_layer):
+            forward_layer, meeting = expand_layer(
+                forward_layer, forward, backward, forward_movies)
+        else:
+            backward_layer, meeting = expand_layer(
+                backward_layer, backward, forward, backward_movies)
+        if meeting is not None:
+            return join_paths(meeting, forward, backward)
+
+    # no solution
+    return None
+
+
+def shortest_path_tree(source):
+    """
+    Runs a breadth-first search from the source over everyone it is
+    connected to, and returns the search tree of (movie_id, person_id)
+    steps. Paths to any target can then be read off in O(path length).
+    """
+    if graph is not None:
+        return graph.shortest_path_tree(source)
+
+    tree = SearchTree(source)
+    layer = [source]
+    scanned_movies = set()
+    while layer:
+        next_layer = []
+        for person_id in layer:
+            for movie_id in people[person_id]["movies"]:
+                if movie_id in scanned_movies:
+                    continue
+                scanned_movies.add(movie_id)
+                for neighbor in movies[movie_id]["stars"]:
+                    if neighbor in tree:
+                        continue
+                    tree.add(neighbor, movie_id, person_id)
+                    next_layer.append(neighbor)
+        layer = next_layer
+    return tree
+
+
+def cached_shortest_path(source, target):
+    """
+    Returns the shortest list of (movie_id, person_id) pairs from the
+    source to the target, reusing the search tree of the source if it
+    is one of the last TREE_CACHE_SIZE sources asked for.
+
+    If no possible path, returns None.
+    """
+    tree = trees.get(source)
+    if tree is None:
+        tree = shortest_path_tree(source)
+        trees.put(source, tree)
+    return tree.path_to(target)
+
+
+def expand_layer(layer, reached, other, scanned_movies):
+    """
+    Expands every person in `layer` by one step, recording how each new
+    person was reached in `reached`. Movies in `scanned_movies` were
+    already scanned by this search and are skipped.
+
+    Returns the next layer and the first person that was already reached
+    by the `other` search (or None if the searches did not meet).
+    """
+    next_layer = []
+    for person_id in layer:
+        for movie_id in people[person_id]["movies"]:
+            if movie_id in scanned_movies:
+                continue
+            scanned_movies.add(movie_id)
+            for neighbor in movies[movie_id]["stars"]:
+                if neighbor in reached:
+                    continue
+                reached[neighbor] = (movie_id, person_id)
+                if neighbor in other:
+                    return next_layer, neighbor
+                next_layer.append(neighbor)
+    return next_layer, None
+
+
+def join_paths(meeting, forward, backward):
+    """
+    Returns the (movie_id, person_id) pairs from the source to the target
+    going through `meeting`, using the steps recorded by both searches.
+    """
+    path = []
+    person_id = meeting
+    while forward[person_id] is not None:
+        movie_id, parent = forward[person_id]
+        path.append((movie_id, person_id))
+        person_id = parent
+    path.reverse()
+
+    person_id = meeting
+    while backward[person_id] is not None:
+        movie_id, person_id = backward[person_id]
+        path.append((movie_id, person_id))
+    return path
+
+
 def person_id_for_name(name):
     """
     Returns the IMDB id for a person's name,
     resolving ambiguities as needed.
     """
-    person_ids = list(names.get(name.lower(), set()))
+    person_ids = person_ids_for_name(name)
+    prefix = len(person_ids) == 0
+    if prefix:
+        # fall back to names starting with what was typed, which are
+        # always confirmed, even when there is only one
+        person_ids = person_ids_for_prefix(name)
+        if len(person_ids) > PREFIX_MATCHES:
+            person_ids = []
     if len(person_ids) == 0:
         return None
-    elif len(person_ids) > 1:
+    elif len(person_ids) > 1 or prefix:
         print(f"Which '{name}'?")
         for person_id in person_ids:
-            person = people[person_id]
+            person = get_person(person_id)
             name = person["name"]
             birth = person["birth"]
             print(f"ID: {person_id}, Name: {name}, Birth: {birth}")
@@ -155,11 +374,207 @@ def person_id_for_name(name):
         return person_ids[0]
 
 
+def person_ids_for_name(name):
+    """
+    Returns the IMDB ids of every person with the given name.
+    """
+    if graph is not None:
+        return graph.person_ids_for_name(name)
+    return names.get(name)
+
+
+def person_ids_for_prefix(prefix):
+    """
+    Returns the IMDB ids of every person whose name starts with `prefix`,
+    ignoring case.
+    """
+    if graph is not None:
+        return graph.person_ids_for_prefix(prefix)
+    return names.prefix(prefix)
+
+
+def resolve_person(query):
+    """
+    Returns the IMDB id for a name or id without asking for input.
+
+    Raises ValueError if no person, or more than one person, matches.
+    """
+    person_ids = person_ids_for_name(query)
+    if len(person_ids) == 1:
+        return person_ids[0]
+    if len(person_ids) > 1:
+        raise ValueError(f"'{query}' is ambiguous: {', '.join(sorted(person_ids))}")
+    try:
+        get_person(query)
+    except KeyError:
+        raise ValueError(f"'{query}' not found")
+    return query
+
+
+def answer_query(source_name, target_name):
+    """
+    Returns a JSON-serializable answer to a single degrees query:
+    the number of degrees and each step of the path, or an error.
+    """
+    answer = {"source": source_name, "target": target_name}
+    try:
+        source = resolve_person(source_name)
+        target = resolve_person(target_name)
+    except ValueError as e:
+        answer["error"] = str(e)
+        return answer
+
+    # Sources asked about again and again get a cached search tree
+    count = source_counts.get(source, 0) + 1
+    source_counts.put(source, count)
+    if oracle is not None and oracle.distance_bounds(source, target)[0] == math.inf:
+        # the landmarks prove there is no path, no need to search
+        path = None
+    elif source in trees or count >= HUB_QUERIES:
+        path = cached_shortest_path(source, target)
+    else:
+        path = bidirectional_shortest_path(source, target)
+    if path is None:
+        answer["degrees"] = None
+        return answer
+    answer["degrees"] = len(path)
+    answer["path"] = [
+        {
+            "movie": get_movie(movie_id)["title"],
+            "person": get_person(person_id)["name"],
+            "person_id": person_id,
+        }
+        for movie_id, person_id in path
+    ]
+    return answer
+
+
+def answer_line(line):
+    """
+    Returns the JSON answer for one batch line holding a source and
+    a target name separated by a tab, or None if the line is blank.
+    """
+    line = line.rstrip("\n")
+    if not line.strip():
+        return None
+    try:
+        source_name, target_name = line.split("\t")
+    except ValueError:
+        answer = {"query": line, "error": "expected two tab-separated names"}
+    else:
+        answer = answer_query(source_name.strip(), target_name.strip())
+    return json.dumps(answer)
+
+
+def run_batch(lines, out, workers=1, chunksize=64):
+    """
+    Answers one query per line of `lines` and writes one JSON line per
+    answer to `out`, in input order, as soon as it is known.
+
+    With more than one worker, the queries are spread over processes
+    forked from this one, so they all share the already loaded data.
+    """
+    for answer in map_queries(answer_line, lines, workers, chunksize):
+        if answer is not None:
+            out.write(answer + "\n")
+            out.flush()
+
+
+def map_queries(function, queries, workers=1, chunksize=64):
+    """
+    Yields `function(query)` for each query, in order, using `workers`
+    processes forked after the data was loaded.
+
+    Forked workers see the loaded graph copy-on-write (and a snapshot
+    mapped by the compact graph is shared outright), so nothing is
+    reloaded or pickled per worker. Falls back to this process when
+    forking is not available.
+    """
+    if workers == 1 or "fork" not in multiprocessing.get_all_start_methods():
+        yield from map(function, queries)
+        return
+
+    # Keep the loaded objects out of the collector so that it does not
+    # touch, and therefore copy, their pages in every worker
+    gc.freeze()
+    try:
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            yield from pool.imap(function, queries, chunksize)
+    finally:
+        gc.unfreeze()
+
+
+def estimate_query(source_name, target_name):
+    """
+    Returns a JSON-serializable estimate of the degrees of separation
+    between two people from the landmark oracle, without searching.
+    """
+    answer = {"source": source_name, "target": target_name}
+    if oracle is None:
+        answer["error"] = "no landmarks loaded"
+        return answer
+    try:
+        source = resolve_person(source_name)
+        target = resolve_person(target_name)
+    except ValueError as e:
+        answer["error"] = str(e)
+        return answer
+
+    lower, upper = oracle.distance_bounds(source, target)
+    # None when the landmarks can neither prove nor rule out a path
+    answer["connected"] = (True if upper != math.inf else
+                           False if lower == math.inf else None)
+    answer["lower"] = lower if lower != math.inf else None
+    answer["upper"] = upper if upper != math.inf else None
+    return answer
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    Answers GET /?source=NAME&target=NAME with the JSON of answer_query,
+    and GET /distance?source=NAME&target=NAME with that of estimate_query.
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if "source" not in query or "target" not in query:
+            self.send_error(400, "source and target are required")
+            return
+        if url.path == "/distance":
+            answer = estimate_query(query["source"][0], query["target"][0])
+        else:
+            answer = answer_query(query["source"][0], query["target"][0])
+        body = json.dumps(answer).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(port, host="127.0.0.1"):
+    """
+    Answers queries over HTTP on `host`:`port` until interrupted,
+    reusing the data that is already loaded.
+    """
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    print(f"Serving on http://{host}:{port}/?source=NAME&target=NAME", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
 def neighbors_for_person(person_id):
     """
     Returns (movie_id, person_id) pairs for people
     who starred with a given person.
     """
+    if graph is not None:
+        return graph.neighbors_for_person(person_id)
     movie_ids = people[person_id]["movies"]
     neighbors = set()
     for movie_id in movie_ids:
@@ -168,5 +583,76 @@ def neighbors_for_person(person_id):
     return neighbors
 
 
+def add_person(person_id, name, birth):
+    """
+    Adds a person with no movies yet to the loaded data (and to the
+    journal of the compact graph's snapshot, if any).
+    Raises ValueError if the person_id is already taken.
+    """
+    if graph is not None:
+        graph.add_person(person_id, name, birth)
+        return
+    if person_id in people:
+        raise ValueError(f"person {person_id} already exists")
+    people[person_id] = {"name": name, "birth": birth, "movies": set()}
+    names.insert(name, person_id)
+
+
+def add_movie(movie_id, title, year):
+    """
+    Adds a movie with no stars yet to the loaded data.
+    Raises ValueError if the movie_id is already taken.
+    """
+    if graph is not None:
+        graph.add_movie(movie_id, title, year)
+        return
+    if movie_id in movies:
+        raise ValueError(f"movie {movie_id} already exists")
+    movies[movie_id] = {"title": title, "year": year, "stars": set()}
+
+
+def add_star(person_id, movie_id):
+    """
+    Records that a known person starred in a known movie, and drops the
+    cached search results that the new credit can change. A loaded
+    landmark oracle keeps its upper bounds but stops trusting its lower
+    bounds from then on.
+    Raises KeyError if the person or movie is unknown.
+    """
+    if graph is not None:
+        cast = [graph.person_ids[p] for p in graph.stars_of(graph.find_movie(movie_id))]
+        if not graph.add_star(person_id, movie_id):
+            return
+    else:
+        if movie_id in people[person_id]["movies"]:
+            return
+        cast = list(movies[movie_id]["stars"])
+        people[person_id]["movies"].add(movie_id)
+        movies[movie_id]["stars"].add(person_id)
+
+    # Only trees that reach the person or the movie's cast can get shorter
+    # paths; trees of other components stay valid
+    affected = [person_id] + cast
+    trees.discard_if(lambda tree: any(p in tree for p in affected))
+
+
+def get_person(person_id):
+    """
+    Returns a dictionary with the name and birth of a person.
+    """
+    if graph is not None:
+        return graph.person(person_id)
+    return people[person_id]
+
+
+def get_movie(movie_id):
+    """
+    Returns a dictionary with the title and year of a movie.
+    """
+    if graph is not None:
+        return graph.movie(movie_id)
+    return movies[movie_id]
+
+
 if __name__ == "__main__":
     main()
@@ -6,7 +6,27 @@ Make sure that this file is in the same directory as degrees.py!
 'Why do we fall sir? So that we can learn to pick ourselves up.'
                                         - Batman Begins (2005)
 """
-from degrees import load_data, person_id_for_name, shortest_path
+import io
+import json
+import math
+import shutil
+
+from degrees import (
+    add_person,
+    add_star,
+    answer_query,
+    bidirectional_shortest_path,
+    cached_shortest_path,
+    estimate_query,
+    load_data,
+    person_id_for_name,
+    person_ids_for_prefix,
+    run_batch,
+    shortest_path,
+)
+from graph import Graph
+from landmarks import LandmarkOracle
+from util import LRUCache
 
 load_data("large")
 
@@ -66,3 +86,162 @@ def test_eight_degree():
     source = person_id_for_name("Juliane Banse")
     target = person_id_for_name("Julian Acosta")
     assert len(shortest_path(source, target)) == 8
+
+
+def test_bidirectional_matches_breadth_first():
+    source = person_id_for_name("Juliane Banse")
+    target = person_id_for_name("Bruce Davison")
+    path = bidirectional_shortest_path(source, target)
+    assert len(path) == len(shortest_path(source, target))
+    assert path[-1][1] == target
+
+
+def test_bidirectional_not_connected():
+    source = person_id_for_name("Tim Zinnemann")
+    target = person_id_for_name("Lahcen Zinoun")
+    assert bidirectional_shortest_path(source, target) is None
+
+
+def test_compact_graph_matches_dicts():
+    graph = Graph.from_csv("large")
+    source = person_id_for_name("Emma Watson")
+    target = person_id_for_name("Jennifer Lawrence")
+    assert len(graph.shortest_path(source, target)) == 3
+    assert graph.shortest_path(source, source) == []
+
+
+def test_snapshot_matches_csv():
+    Graph.open("large")
+    graph = Graph.open("large")
+    source = person_id_for_name("Tom Cruise")
+    target = person_id_for_name("Tom Hanks")
+    assert len(graph.shortest_path(source, target)) == 2
+
+
+def test_batch():
+    out = io.StringIO()
+    run_batch(["Tom Cruise\tTom Hanks\n", "Nobody Atall\tTom Hanks\n"], out)
+    first, second = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert first["degrees"] == 2
+    assert "error" in second
+
+
+def test_batch_workers_keep_order():
+    lines = ["Tom Cruise\tTom Hanks\n", "Emma Watson\tJennifer Lawrence\n"] * 50
+    out = io.StringIO()
+    run_batch(lines, out, workers=4, chunksize=8)
+    answers = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [answer["degrees"] for answer in answers] == [2, 3] * 50
+
+
+def test_cached_tree_from_hub():
+    source = person_id_for_name("Juliane Banse")
+    assert len(cached_shortest_path(source, person_id_for_name("Bruce Davison"))) == 6
+    assert len(cached_shortest_path(source, person_id_for_name("Julian Acosta"))) == 8
+
+
+def test_cache_drops_heaviest_total():
+    cache = LRUCache(4, 5, len)
+    cache.put("a", "xx")
+    cache.put("b", "xx")
+    cache.put("c", "xx")
+    assert "a" not in cache and len(cache) == 2
+    cache.put("b", "xxxx")
+    assert "c" not in cache and cache.get("b") == "xxxx"
+    cache.discard_if(lambda value: True)
+    cache.put("d", "xxxxx")
+    assert "d" in cache
+
+
+def test_name_lookup_ignores_case():
+    assert person_id_for_name("tom HANKS") == person_id_for_name("Tom Hanks")
+    assert person_id_for_name("Tom Hanks") in person_ids_for_prefix("tom h")
+
+
+def test_single_prefix_match_asks(monkeypatch, capsys):
+    load_data("small")
+    try:
+        # only Tom Cruise starts with "Tom Cr" in the small dataset
+        monkeypatch.setattr("builtins.input", lambda prompt: "")
+        assert person_id_for_name("Tom Cr") is None
+        assert "Which 'Tom Cr'?" in capsys.readouterr().out
+        monkeypatch.setattr("builtins.input", lambda prompt: "129")
+        assert person_id_for_name("Tom Cr") == "129"
+    finally:
+        load_data("large")
+
+
+def test_landmark_bounds():
+    graph = Graph.open("large")
+    oracle = LandmarkOracle.open(graph, "large", 8)
+    source = person_id_for_name("Emma Watson")
+    target = person_id_for_name("Jennifer Lawrence")
+    lower, upper = oracle.distance_bounds(source, target)
+    assert lower <= 3 <= upper
+    assert oracle.approximate_distance(source, target) == upper
+
+
+def test_landmarks_on_long_chain(tmp_path):
+    # 300 people, each starring with the next one in a movie of their own
+    size = 300
+    (tmp_path / "people.csv").write_text(
+        "id,name,birth\n" + "".join(f"{i},Person {i},\n" for i in range(size)))
+    (tmp_path / "movies.csv").write_text(
+        "id,title,year\n" + "".join(f"{i},Movie {i},\n" for i in range(size - 1)))
+    (tmp_path / "stars.csv").write_text(
+        "person_id,movie_id\n" + "".join(f"{i},{i}\n{i + 1},{i}\n" for i in range(size - 1)))
+    graph = Graph.open(tmp_path)
+    oracle = LandmarkOracle.open(graph, tmp_path, 2)
+    lower, upper = oracle.distance_bounds("0", str(size - 1))
+    assert lower <= size - 1 <= upper < math.inf
+
+
+def test_added_credit_reaches_cached_tree():
+    source = person_id_for_name("Tom Cruise")
+    movie_id = shortest_path(source, person_id_for_name("Tom Hanks"))[-1][0]
+    assert cached_shortest_path(source, "test-person") is None
+
+    add_person("test-person", "Test Person", "")
+    add_star("test-person", movie_id)
+    assert len(cached_shortest_path(source, "test-person")) <= 2
+    assert bidirectional_shortest_path(source, "test-person")[-1] == (movie_id, "test-person")
+
+
+def test_landmarks_after_journaled_credit(tmp_path):
+    directory = tmp_path / "small"
+    shutil.copytree("small", directory)
+    graph = Graph.open(directory)
+    LandmarkOracle.open(graph, directory, 3)
+    # Emma Watson joins Kevin Bacon in Apollo 13
+    graph.add_star("914612", "104257")
+
+    # after a restart the journal is replayed and the landmarks measured again
+    graph = Graph.open(directory)
+    oracle = LandmarkOracle.open(graph, directory, 3)
+    lower, upper = oracle.distance_bounds("102", "914612")
+    assert lower <= 1 <= upper
+
+
+def test_landmarks_added_person(tmp_path):
+    directory = tmp_path / "small"
+    shutil.copytree("small", directory)
+    graph = Graph.open(directory)
+    oracle = LandmarkOracle.open(graph, directory, 3)
+    graph.add_person("test-person", "Test Person", "")
+    assert oracle.distance_bounds("129", "test-person") == (0, math.inf)
+    assert oracle.approximate_distance("129", "test-person") is None
+
+
+def test_added_credit_keeps_landmarks(tmp_path):
+    directory = tmp_path / "small"
+    shutil.copytree("small", directory)
+    load_data(directory, landmarks=3)
+    try:
+        assert estimate_query("Kevin Bacon", "Emma Watson")["connected"] is False
+        # Emma Watson joins Kevin Bacon in Apollo 13
+        add_star("914612", "112384")
+        assert estimate_query("Kevin Bacon", "Emma Watson")["connected"] is None
+        assert estimate_query("Kevin Bacon", "Tom Cruise")["connected"] is True
+        assert answer_query("Kevin Bacon", "Emma Watson")["degrees"] == 1
+    finally:
+        load_data("large")
@@ -0,0 +1,666 @@
+import json
+import mmap
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+
+from util import read_rows
+
+# Name of the snapshot file written next to the CSV files
+SNAPSHOT = "degrees.snapshot"
+SNAPSHOT_MAGIC = b"DEGSNAP1"
+# Name of the file of people, movies and stars added since the snapshot
+JOURNAL = "degrees.journal"
+SNAPSHOT_VERSION = 1
+SOURCES = ("people.csv", "movies.csv", "stars.csv")
+
+# Integer arrays and string tables stored in a snapshot, in file order
+ARRAYS = ("person_offsets", "person_movies", "movie_offsets", "movie_stars",
+          "person_order", "movie_order", "name_order")
+TABLES = ("person_ids", "person_names", "person_births",
+          "movie_ids", "movie_titles", "movie_years")
+
+
+class Graph():
+    """
+    Compact actor/movie graph.
+
+    Person and movie ids are interned to dense integers, and the star
+    edges are kept twice in CSR form: `person_offsets`/`person_movies`
+    list the movies of each person, `movie_offsets`/`movie_stars` the
+    people of each movie. Every edge costs 4 bytes in each direction.
+
+    Ids and names are looked up by bisecting sorted permutations of the
+    person and movie indices, so no per-person dictionaries are needed.
+
+    People, movies and stars added after loading get the next free
+    indices and live in small dictionaries next to the arrays, so the
+    arrays (and a mapped snapshot) never have to be rebuilt.
+    """
+
+    def __init__(self, person_ids, person_names, person_births,
+                 movie_ids, movie_titles, movie_years,
+                 person_offsets, person_movies, movie_offsets, movie_stars,
+                 person_order=None, movie_order=None, name_order=None):
+        self.person_ids = person_ids
+        self.person_names = person_names
+        self.person_births = person_births
+        self.movie_ids = movie_ids
+        self.movie_titles = movie_titles
+        self.movie_years = movie_years
+        self.person_offsets = person_offsets
+        self.person_movies = person_movies
+        self.movie_offsets = movie_offsets
+        self.movie_stars = movie_stars
+
+        if person_order is None:
+            person_order = sort_order(person_ids)
+        if movie_order is None:
+            movie_order = sort_order(movie_ids)
+        if name_order is None:
+            name_order = sort_order(person_names, key=str.lower)
+        self.person_order = person_order
+        self.movie_order = movie_order
+        self.name_order = name_order
+
+        # Indices of people and movies added after loading, by id and name
+        self.added_people = {}
+        self.added_movies = {}
+        self.added_names = {}
+        # Movies and stars added after loading, by person and movie index
+        self.extra_movies = {}
+        self.extra_stars = {}
+        # File every addition is appended to, if any
+        self.journal = None
+        # Number of additions made since loading, replayed ones included
+        self.additions = 0
+
+    @classmethod
+    def open(cls, directory):
+        """
+        Load the graph for `directory` from its snapshot file, or from the
+        CSV files if the snapshot is missing or older than them. In the
+        latter case a fresh snapshot is written for the next run.
+
+        Additions journaled since the snapshot was written are replayed,
+        and later additions are appended to the same journal. A journal
+        belongs to its snapshot: when the CSV files change, both are
+        discarded and rebuilt from the CSV files.
+        """
+        path = os.path.join(directory, SNAPSHOT)
+        sources = source_stats(directory)
+        try:
+            graph = cls.from_snapshot(path, sources)
+        except (OSError, ValueError):
+            graph = cls.from_csv(directory)
+            try:
+                graph.save(path, sources)
+            except OSError:
+                # read-only data directory, just parse again next time
+                return graph
+
+        try:
+            graph.attach_journal(os.path.join(directory, JOURNAL), sources)
+        except OSError:
+            pass
+        return graph
+
+    @classmethod
+    def from_csv(cls, directory):
+        """
+        Load the graph from the people, movies and stars CSV files
+        in `directory`, reading them one row at a time.
+        """
+        person_ids, person_names, person_births = [], [], []
+        for person_id, name, birth in read_rows(
+                f"{directory}/people.csv", "id", "name", "birth"):
+            person_ids.append(person_id)
+            person_names.append(name)
+            person_births.append(birth)
+
+        movie_ids, movie_titles, movie_years = [], [], []
+        for movie_id, title, year in read_rows(
+                f"{directory}/movies.csv", "id", "title", "year"):
+            movie_ids.append(movie_id)
+            movie_titles.append(title)
+            movie_years.append(year)
+
+        person_order = sort_order(person_ids)
+        movie_order = sort_order(movie_ids)
+        star_people = array("I")
+        star_movies = array("I")
+        for person_id, movie_id in read_rows(
+                f"{directory}/stars.csv", "person_id", "movie_id"):
+            try:
+                p = lookup(person_order, person_ids, person_id)
+                m = lookup(movie_order, movie_ids, movie_id)
+            except KeyError:
+                continue
+            star_people.append(p)
+            star_movies.append(m)
+
+        person_offsets, person_movies = build_csr(
+            len(person_ids), star_people, star_movies)
+        movie_offsets, movie_stars = build_csr(
+            len(movie_ids), star_movies, star_people)
+        return cls(person_ids, person_names, person_births,
+                   movie_ids, movie_titles, movie_years,
+                   person_offsets, person_movies, movie_offsets, movie_stars,
+                   person_order, movie_order)
+
+    @classmethod
+    def from_snapshot(cls, path, sources):
+        """
+        Map the snapshot file at `path` into memory.
+
+        Raises ValueError if the file is not a snapshot or was built from
+        CSV files with different sizes or modification times than `sources`.
+        """
+        header, fields = map_sections(path, SNAPSHOT_MAGIC)
+        if header["version"] != SNAPSHOT_VERSION:
+            raise ValueError("unsupported snapshot version")
+        if header["sources"] != sources:
+            raise ValueError("snapshot is out of date")
+
+        for name in TABLES:
+            fields[name] = StringTable(fields.pop(name + "_offsets"),
+                                       fields.pop(name + "_blob"))
+        return cls(**fields)
+
+    def save(self, path, sources):
+        """
+        Write the graph to a snapshot file at `path`, recording the
+        sizes and modification times of its CSV `sources`.
+
+        Raises ValueError once anything was added, as additions are kept
+        in the journal next to the snapshot instead.
+        """
+        if self.added_people or self.added_movies or self.extra_movies:
+            raise ValueError("cannot snapshot a graph with additions")
+        sections = []
+        for name in ARRAYS:
+            sections.append((name, "I", getattr(self, name)))
+        for name in TABLES:
+            offsets, blob = encode_table(getattr(self, name))
+            sections.append((name + "_offsets", "Q", offsets))
+            sections.append((name + "_blob", "B", blob))
+
+        header = {"version": SNAPSHOT_VERSION, "sources": sources}
+        write_sections(path, SNAPSHOT_MAGIC, header, sections)
+
+    def attach_journal(self, path, sources):
+        """
+        Replay the additions journaled at `path` for the snapshot built
+        from `sources`, and append every later addition to it. A journal
+        made for another snapshot is started over.
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                header = json.loads(f.readline() or "null")
+                if header == {"sources": sources}:
+                    for line in f:
+                        kind, *fields = json.loads(line)
+                        getattr(self, "add_" + kind)(*fields)
+                else:
+                    header = None
+        except FileNotFoundError:
+            header = None
+        if header is None:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"sources": sources}) + "\n")
+        self.journal = path
+
+    def record(self, kind, *fields):
+        """
+        Count an addition and append it to the journal, if there is one.
+        """
+        self.additions += 1
+        if self.journal is not None:
+            with open(self.journal, "a", encoding="utf-8") as f:
+                f.write(json.dumps([kind, *fields]) + "\n")
+
+    def grow(self):
+        """
+        Make the id, name and title tables appendable.
+        """
+        for name in TABLES:
+            table = getattr(self, name)
+            if not isinstance(table, AppendTable):
+                setattr(self, name, AppendTable(table))
+
+    def add_person(self, person_id, name, birth):
+        """
+        Add a person with no movies yet. Raises ValueError if the id is taken.
+        """
+        try:
+            self.find_person(person_id)
+        except KeyError:
+            pass
+        else:
+            raise ValueError(f"person {person_id} already exists")
+        self.grow()
+        p = len(self.person_ids)
+        self.person_ids.append(person_id)
+        self.person_names.append(name)
+        self.person_births.append(birth)
+        self.added_people[person_id] = p
+        self.added_names.setdefault(name.lower(), []).append(p)
+        self.record("person", person_id, name, birth)
+
+    def add_movie(self, movie_id, title, year):
+        """
+        Add a movie with no stars yet. Raises ValueError if the id is taken.
+        """
+        try:
+            self.find_movie(movie_id)
+        except KeyError:
+            pass
+        else:
+            raise ValueError(f"movie {movie_id} already exists")
+        self.grow()
+        m = len(self.movie_ids)
+        self.movie_ids.append(movie_id)
+        self.movie_titles.append(title)
+        self.movie_years.append(year)
+        self.added_movies[movie_id] = m
+        self.record("movie", movie_id, title, year)
+
+    def add_star(self, person_id, movie_id):
+        """
+        Record that a person starred in a movie, both already known.
+        Returns False if that was already known.
+        """
+        p = self.find_person(person_id)
+        m = self.find_movie(movie_id)
+        if m in self.movies_of(p):
+            return False
+        self.extra_movies.setdefault(p, []).append(m)
+        self.extra_stars.setdefault(m, []).append(p)
+        self.record("star", person_id, movie_id)
+        return True
+
+    def find_person(self, person_id):
+        """
+        Returns the integer index of a person, raising KeyError if unknown.
+        """
+        if person_id in self.added_people:
+            return self.added_people[person_id]
+        return lookup(self.person_order, self.person_ids, person_id)
+
+    def find_movie(self, movie_id):
+        """
+        Returns the integer index of a movie, raising KeyError if unknown.
+        """
+        if movie_id in self.added_movies:
+            return self.added_movies[movie_id]
+        return lookup(self.movie_order, self.movie_ids, movie_id)
+
+    def person(self, person_id):
+        """
+        Returns the name and birth of a person, like an entry of `people`.
+        """
+        i = self.find_person(person_id)
+        return {"name": self.person_names[i], "birth": self.person_births[i]}
+
+    def movie(self, movie_id):
+        """
+        Returns the title and year of a movie, like an entry of `movies`.
+        """
+        i = self.find_movie(movie_id)
+        return {"title": self.movie_titles[i], "year": self.movie_years[i]}
+
+    def person_ids_for_name(self, name):
+        """
+        Returns the IMDB ids of every person with the given name.
+        """
+        name = name.lower()
+        key = lambda i: self.person_names[i].lower()
+        lo = bisect_left(self.name_order, name, key=key)
+        hi = bisect_right(self.name_order, name, lo=lo, key=key)
+        indices = list(self.name_order[lo:hi]) + self.added_names.get(name, [])
+        return [self.person_ids[i] for i in indices]
+
+    def person_ids_for_prefix(self, prefix):
+        """
+        Returns the IMDB ids of every person whose name starts with
+        `prefix`, ignoring case.
+        """
+        prefix = prefix.lower()
+        key = lambda i: self.person_names[i].lower()
+        lo = bisect_left(self.name_order, prefix, key=key)
+        hi = bisect_left(self.name_order, prefix + "\U0010ffff", lo=lo, key=key)
+        indices = list(self.name_order[lo:hi])
+        for name, added in self.added_names.items():
+            if name.startswith(prefix):
+                indices.extend(added)
+        return [self.person_ids[i] for i in indices]
+
+    def movies_of(self, p):
+        extra = self.extra_movies.get(p)
+        if p >= len(self.person_offsets) - 1:
+            return extra or []
+        movies = self.person_movies[self.person_offsets[p]:self.person_offsets[p + 1]]
+        return movies if extra is None else list(movies) + extra
+
+    def stars_of(self, m):
+        extra = self.extra_stars.get(m)
+        if m >= len(self.movie_offsets) - 1:
+            return extra or []
+        stars = self.movie_stars[self.movie_offsets[m]:self.movie_offsets[m + 1]]
+        return stars if extra is None else list(stars) + extra
+
+    def neighbors_for_person(self, person_id):
+        """
+        Returns (movie_id, person_id) pairs for people
+        who starred with a given person.
+        """
+        neighbors = set()
+        for m in self.movies_of(self.find_person(person_id)):
+            for p in self.stars_of(m):
+                neighbors.add((self.movie_ids[m], self.person_ids[p]))
+        return neighbors
+
+    def shortest_path(self, source, target):
+        """
+        Returns the shortest list of (movie_id, person_id) pairs
+        that connect the source to the target, searching from both ends.
+
+        If no possible path, returns None.
+        """
+        s = self.find_person(source)
+        t = self.find_person(target)
+        if s == t:
+            return []
+
+        forward = {s: None}
+        backward = {t: None}
+        forward_layer = [s]
+        backward_layer = [t]
+        forward_movies = set()
+        backward_movies = set()
+
+        while forward_layer and backward_layer:
+            if len(forward_layer) <= len(backward_layer):
+                forward_layer, meeting = self.expand_layer(
+                    forward_layer, forward, backward, forward_movies)
+            else:
+                backward_layer, meeting = self.expand_layer(
+                    backward_layer, backward, forward, backward_movies)
+            if meeting is not None:
+                return self.join_paths(meeting, forward, backward)
+
+        return None
+
+    def shortest_path_tree(self, source):
+        """
+        Runs a breadth-first search over the whole component of `source`
+        and returns its search tree.
+        """
+        s = self.find_person(source)
+        tree = CompactSearchTree(self, s)
+        parent_movies = tree.parent_movies
+        parent_people = tree.parent_people
+        depths = tree.depths
+        scanned_movies = bytearray(len(self.movie_ids))
+        layer = [s]
+        depth = 0
+        while layer:
+            depth += 1
+            next_layer = []
+            for p in layer:
+                for m in self.movies_of(p):
+                    if scanned_movies[m]:
+                        continue
+                    scanned_movies[m] = 1
+                    for q in self.stars_of(m):
+                        if depths[q] >= 0:
+                            continue
+                        parent_movies[q] = m
+                        parent_people[q] = p
+                        depths[q] = depth
+                        next_layer.append(q)
+            layer = next_layer
+        return tree
+
+    def expand_layer(self, layer, reached, other, scanned_movies):
+        """
+        Expands every person index in `layer` by one step, scanning each
+        movie's cast at most once per search.
+        Returns the next layer and the person where the searches met, if any.
+        """
+        next_layer = []
+        for p in layer:
+            for m in self.movies_of(p):
+                if m in scanned_movies:
+                    continue
+                scanned_movies.add(m)
+                for q in self.stars_of(m):
+                    if q in reached:
+                        continue
+                    reached[q] = (m, p)
+                    if q in other:
+                        return next_layer, q
+                    next_layer.append(q)
+        return next_layer, None
+
+    def join_paths(self, meeting, forward, backward):
+        """
+        Returns the (movie_id, person_id) pairs through `meeting`.
+        """
+        steps = []
+        p = meeting
+        while forward[p] is not None:
+            m, parent = forward[p]
+            steps.append((m, p))
+            p = parent
+        steps.reverse()
+
+        p = meeting
+        while backward[p] is not None:
+            m, p = backward[p]
+            steps.append((m, p))
+        return [(self.movie_ids[m], self.person_ids[p]) for m, p in steps]
+
+
+def build_csr(count, keys, values):
+    """
+    Groups `values` by `keys` (both integer arrays of the same length).
+    Returns an offsets array of length `count + 1` and the grouped values,
+    so that the values of key k are `targets[offsets[k]:offsets[k + 1]]`.
+    """
+    offsets = array("I", [0]) * (count + 1)
+    for k in keys:
+        offsets[k + 1] += 1
+    for k in range(count):
+        offsets[k + 1] += offsets[k]
+
+    positions = offsets[:-1]
+    targets = array("I", [0]) * len(keys)
+    for k, v in zip(keys, values):
+        targets[positions[k]] = v
+        positions[k] += 1
+    return offsets, targets
+
+
+class StringTable():
+    """
+    Read-only sequence of strings stored as one UTF-8 blob plus an array
+    of offsets, decoded one entry at a time on access.
+    """
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], "utf-8")
+
+
+class CompactSearchTree():
+    """
+    Breadth-first search tree of a `Graph` from a single person, stored
+    as arrays indexed by person: the movie and person each one was
+    reached through, and its depth (-1 when unreachable).
+    """
+
+    def __init__(self, graph, root):
+        size = len(graph.person_ids)
+        self.graph = graph
+        self.root = root
+        self.parent_movies = array("i", [-1]) * size
+        self.parent_people = array("i", [-1]) * size
+        self.depths = array("i", [-1]) * size
+        self.depths[root] = 0
+
+    def __contains__(self, person_id):
+        return self.distance(person_id) is not None
+
+    def distance(self, person_id):
+        try:
+            depth = self.depths[self.graph.find_person(person_id)]
+        except (KeyError, IndexError):
+            # unknown, or added after this tree was grown
+            return None
+        return depth if depth >= 0 else None
+
+    def path_to(self, person_id):
+        if self.distance(person_id) is None:
+            return None
+        p = self.graph.find_person(person_id)
+        path = []
+        while p != self.root:
+            m = self.parent_movies[p]
+            path.append((self.graph.movie_ids[m], self.graph.person_ids[p]))
+            p = self.parent_people[p]
+        path.reverse()
+        return path
+
+
+def map_sections(path, magic):
+    """
+    Map a file written by `write_sections` into memory.
+    Returns its header and a dictionary of its sections, each a
+    memoryview cast to the typecode it was written with.
+
+    Raises ValueError if the file does not start with `magic`.
+    """
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(data)
+    if bytes(view[:8]) != magic:
+        raise ValueError(f"{path} is not a {magic.decode()} file")
+    size = int.from_bytes(view[8:16], "little")
+    header = json.loads(bytes(view[16:16 + size]))
+
+    start = 16 + padded(size)
+    fields = {}
+    for name, typecode, offset, length in header["sections"]:
+        section = view[start + offset:start + offset + length]
+        fields[name] = section.cast(typecode)
+    return header, fields
+
+
+def write_sections(path, magic, header, sections):
+    """
+    Write `magic`, a JSON `header` and the (name, typecode, values)
+    `sections` to `path`, each section aligned to 8 bytes so that it can
+    be mapped back as an array.
+    """
+    header = dict(header, sections=[])
+    chunks = []
+    offset = 0
+    for name, typecode, values in sections:
+        chunk = memoryview(values).cast("B")
+        header["sections"].append([name, typecode, offset, len(chunk)])
+        chunks.append(chunk)
+        offset += padded(len(chunk))
+    encoded = json.dumps(header).encode("utf-8")
+
+    # write to a temporary file first so readers never see half a file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(magic)
+        f.write(len(encoded).to_bytes(8, "little"))
+        f.write(encoded.ljust(padded(len(encoded)), b" "))
+        for chunk in chunks:
+            f.write(chunk)
+            f.write(bytes(padded(len(chunk)) - len(chunk)))
+    os.replace(temporary, path)
+
+
+class AppendTable():
+    """
+    Table of strings that can be appended to without copying the
+    (possibly read-only) table it starts from.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.extra = []
+
+    def __len__(self):
+        return len(self.base) + len(self.extra)
+
+    def __getitem__(self, i):
+        if i < len(self.base):
+            return self.base[i]
+        return self.extra[i - len(self.base)]
+
+    def append(self, string):
+        self.extra.append(string)
+
+
+def encode_table(strings):
+    """
+    Returns the offsets array and UTF-8 blob for a sequence of strings.
+    """
+    if isinstance(strings, StringTable):
+        return strings.offsets, strings.blob
+    offsets = array("Q", [0])
+    encoded = []
+    for string in strings:
+        string = string.encode("utf-8")
+        encoded.append(string)
+        offsets.append(offsets[-1] + len(string))
+    return offsets, b"".join(encoded)
+
+
+def sort_order(table, key=None):
+    """
+    Returns the indices of `table` sorted by their values.
+    """
+    if key is None:
+        return array("I", sorted(range(len(table)), key=table.__getitem__))
+    return array("I", sorted(range(len(table)), key=lambda i: key(table[i])))
+
+
+def lookup(order, table, value):
+    """
+    Returns the index of `value` in `table`, given the sorted `order`
+    of its indices. Raises KeyError if `value` is not in the table.
+    """
+    i = bisect_left(order, value, key=table.__getitem__)
+    if i < len(order) and table[order[i]] == value:
+        return order[i]
+    raise KeyError(value)
+
+
+def source_stats(directory):
+    """
+    Returns the size and modification time of each CSV file in `directory`.
+    """
+    stats = {}
+    for name in SOURCES:
+        stat = os.stat(os.path.join(directory, name))
+        stats[name] = [stat.st_size, stat.st_mtime_ns]
+    return stats
+
+
+def padded(size):
+    """
+    Rounds `size` up to a multiple of 8 bytes.
+    """
+    return (size + 7) // 8 * 8
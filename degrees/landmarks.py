@@ -0,0 +1,219 @@
+import math
+import os
+import sys
+from array import array
+
+from graph import Graph, map_sections, source_stats, write_sections
+
+# Name of the landmark file written next to the CSV files
+LANDMARKS = "degrees.landmarks"
+LANDMARKS_MAGIC = b"DEGLAND1"
+LANDMARKS_VERSION = 3
+
+# Default number of landmarks
+LANDMARK_COUNT = 16
+
+# Distance stored for people a landmark cannot reach
+UNREACHABLE = 0xFFFF
+
+# Distance stored for people a landmark reaches only at this depth or more
+FARTHEST = 0xFFFE
+
+
+class LandmarkOracle():
+    """
+    Distance oracle over a `Graph` using a few landmark people.
+
+    Stores the breadth-first distance from every landmark to every person
+    (two bytes each). By the triangle inequality, for any landmark L,
+        |d(L, s) - d(L, t)| <= d(s, t) <= d(L, s) + d(L, t)
+    which gives instant distance bounds without searching.
+
+    Additions to the graph after measuring can only shrink distances, so
+    upper bounds stay valid, but lower bounds are no longer trusted.
+    """
+
+    def __init__(self, graph, landmarks, distances):
+        self.graph = graph
+        self.landmarks = landmarks
+        self.distances = distances
+        # Number of graph additions the distances were measured with
+        self.additions = graph.additions
+
+    @classmethod
+    def open(cls, graph, directory, count=LANDMARK_COUNT):
+        """
+        Load the landmarks for `directory` from its landmark file, or
+        choose and measure them again if the file is missing or was made
+        from other CSV files or another number of journaled additions.
+        In the latter case the file is rewritten.
+        """
+        path = os.path.join(directory, LANDMARKS)
+        sources = source_stats(directory)
+        try:
+            oracle = cls.from_file(graph, path, sources)
+            if len(oracle.landmarks) == count:
+                return oracle
+        except (OSError, ValueError):
+            pass
+
+        oracle = cls.build(graph, count)
+        try:
+            oracle.save(path, sources)
+        except OSError:
+            pass
+        return oracle
+
+    @classmethod
+    def build(cls, graph, count=LANDMARK_COUNT):
+        """
+        Choose `count` landmarks and measure their distance to everyone.
+
+        The first landmark is the person with the most movies; each next
+        one is the person farthest from all landmarks chosen so far, so
+        that the landmarks surround the graph instead of clustering.
+        """
+        size = len(graph.person_ids)
+        if size == 0:
+            return cls(graph, [], [])
+        first = max(range(size), key=lambda p: len(graph.movies_of(p)))
+
+        landmarks = []
+        distances = []
+        # distance from each person to the nearest landmark so far
+        nearest = array("H", [UNREACHABLE]) * size
+        landmark = first
+        while len(landmarks) < count:
+            row = measure(graph, landmark)
+            landmarks.append(landmark)
+            distances.append(row)
+            for p in range(size):
+                if row[p] < nearest[p]:
+                    nearest[p] = row[p]
+
+            # farthest person that the first landmark can still reach
+            landmark = max(
+                (p for p in range(size) if distances[0][p] != UNREACHABLE),
+                key=nearest.__getitem__)
+            if nearest[landmark] == 0:
+                break
+        return cls(graph, landmarks, distances)
+
+    @classmethod
+    def from_file(cls, graph, path, sources):
+        """
+        Map the landmark file at `path` into memory.
+
+        Raises ValueError if it is not a landmark file or was built from
+        CSV files other than `sources` or before `graph` had all of its
+        additions.
+        """
+        header, fields = map_sections(path, LANDMARKS_MAGIC)
+        if header["version"] != LANDMARKS_VERSION:
+            raise ValueError("unsupported landmark file version")
+        if header["sources"] != sources or header["additions"] != graph.additions:
+            raise ValueError("landmark file is out of date")
+        landmarks = [graph.find_person(person_id) for person_id in header["landmarks"]]
+        distances = [fields[f"distances{i}"] for i in range(len(landmarks))]
+        return cls(graph, landmarks, distances)
+
+    def save(self, path, sources):
+        """
+        Write the landmarks and their distances to `path`.
+        """
+        header = {
+            "version": LANDMARKS_VERSION,
+            "sources": sources,
+            "additions": self.additions,
+            "landmarks": [self.graph.person_ids[p] for p in self.landmarks],
+        }
+        sections = [(f"distances{i}", "H", row) for i, row in enumerate(self.distances)]
+        write_sections(path, LANDMARKS_MAGIC, header, sections)
+
+    def bounds(self, s, t):
+        """
+        Returns lower and upper bounds on the distance between person
+        indices `s` and `t`. The lower bound is infinite when some landmark
+        reaches one but not the other; the upper bound is infinite when no
+        landmark reaches both. Once the graph has additions the landmarks
+        did not measure, the lower bound is always 0. Landmarks that reach either person only at
+        FARTHEST or more say nothing about them. People added after the
+        landmarks were measured have no bounds.
+        """
+        lower = 0
+        upper = math.inf
+        if not self.measured(s) or not self.measured(t):
+            return lower, upper
+        exact = self.graph.additions == self.additions
+        for row in self.distances:
+            ds = row[s]
+            dt = row[t]
+            if ds == UNREACHABLE and dt == UNREACHABLE:
+                continue
+            if ds == UNREACHABLE or dt == UNREACHABLE:
+                if exact:
+                    return math.inf, math.inf
+                continue
+            if ds == FARTHEST or dt == FARTHEST:
+                continue
+            if exact:
+                lower = max(lower, abs(ds - dt))
+            upper = min(upper, ds + dt)
+        return lower, upper
+
+    def measured(self, p):
+        """
+        Returns whether the landmarks measured their distance to person
+        index `p`.
+        """
+        return bool(self.distances) and p < len(self.distances[0])
+
+    def distance_bounds(self, source, target):
+        """
+        Returns lower and upper bounds on the degrees of separation
+        between two people, without searching.
+        """
+        return self.bounds(self.graph.find_person(source),
+                           self.graph.find_person(target))
+
+    def approximate_distance(self, source, target):
+        """
+        Returns an estimate of the degrees of separation between two
+        people (the best landmark upper bound), or None if they are not
+        known to be connected.
+        """
+        lower, upper = self.distance_bounds(source, target)
+        if upper == math.inf:
+            return None
+        return upper
+
+
+def measure(graph, landmark):
+    """
+    Returns the breadth-first distance from person index `landmark` to
+    every person, two bytes each, UNREACHABLE when not connected and
+    FARTHEST when at least that far.
+    """
+    tree = graph.shortest_path_tree(graph.person_ids[landmark])
+    return array("H", (
+        UNREACHABLE if depth < 0 else min(depth, FARTHEST)
+        for depth in tree.depths
+    ))
+
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        sys.exit("Usage: python landmarks.py directory [count]")
+    directory = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) == 3 else LANDMARK_COUNT
+
+    print("Loading data...")
+    graph = Graph.open(directory)
+    print("Measuring landmarks...")
+    oracle = LandmarkOracle.open(graph, directory, count)
+    for p in oracle.landmarks:
+        print(f"  {graph.person_ids[p]}: {graph.person_names[p]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,13 @@
+import csv
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+
+
 class Node():
+    # Search trees hold many nodes, so keep them free of a per-instance dict
+    __slots__ = ("state", "parent", "action")
+
     def __init__(self, state, parent, action):
         self.state = state
         self.parent = parent
@@ -36,3 +45,199 @@ class QueueFrontier(StackFrontier):
             node = self.frontier[0]
             self.frontier = self.frontier[1:]
             return node
+
+
+class IndexedStackFrontier():
+    """
+    Stack frontier backed by a deque, with a count of the states it holds
+    so that add, remove and contains_state all take constant time.
+    """
+    def __init__(self):
+        self.frontier = deque()
+        self.states = {}
+
+    def add(self, node):
+        self.frontier.append(node)
+        self.states[node.state] = self.states.get(node.state, 0) + 1
+
+    def contains_state(self, state):
+        return state in self.states
+
+    def empty(self):
+        return len(self.frontier) == 0
+
+    def remove(self):
+        if self.empty():
+            raise Exception("empty frontier")
+        else:
+            return self.forget(self.frontier.pop())
+
+    def forget(self, node):
+        count = self.states[node.state]
+        if count == 1:
+            del self.states[node.state]
+        else:
+            self.states[node.state] = count - 1
+        return node
+
+
+class IndexedQueueFrontier(IndexedStackFrontier):
+
+    def remove(self):
+        if self.empty():
+            raise Exception("empty frontier")
+        else:
+            return self.forget(self.frontier.popleft())
+
+
+class SearchTree():
+    """
+    Breadth-first search tree grown from a single root state.
+    Maps every reached state to the action and parent it was reached by,
+    and to its depth, so paths to any state are rebuilt in O(depth).
+    """
+    def __init__(self, root):
+        self.root = root
+        self.parents = {root: None}
+        self.depths = {root: 0}
+
+    def __contains__(self, state):
+        return state in self.parents
+
+    def __len__(self):
+        return len(self.parents)
+
+    def add(self, state, action, parent):
+        self.parents[state] = (action, parent)
+        self.depths[state] = self.depths[parent] + 1
+
+    def distance(self, state):
+        return self.depths.get(state)
+
+    def path_to(self, state):
+        if state not in self.parents:
+            return None
+        path = []
+        while self.parents[state] is not None:
+            action, parent = self.parents[state]
+            path.append((action, state))
+            state = parent
+        path.reverse()
+        return path
+
+
+class LRUCache():
+    """
+    Mapping that holds at most `maxsize` entries, dropping the least
+    recently used one when full. Safe to share between threads.
+
+    With `maxweight`, least recently used entries are also dropped while
+    the total `weight(value)` of the entries exceeds it.
+    """
+    def __init__(self, maxsize, maxweight=None, weight=None):
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self.weight = weight
+        self.entries = OrderedDict()
+        self.weights = {}
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = value
+            if self.maxweight is not None:
+                self.weights[key] = self.weight(value)
+                self.total += self.weights[key]
+            while self.entries and (len(self.entries) > self.maxsize or
+                                    self.maxweight is not None and self.total > self.maxweight):
+                self.remove(next(iter(self.entries)))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.weights.clear()
+            self.total = 0
+
+    def discard_if(self, predicate):
+        with self.lock:
+            for key in [k for k, v in self.entries.items() if predicate(v)]:
+                self.remove(key)
+
+    def remove(self, key):
+        del self.entries[key]
+        if self.maxweight is not None:
+            self.total -= self.weights.pop(key)
+
+
+class NameIndex():
+    """
+    Sorted list of lowercase names next to the ids they belong to,
+    for case-insensitive exact and prefix lookups by bisection.
+    Call `sort` after adding names and before looking any up.
+    """
+    def __init__(self):
+        self.keys = []
+        self.ids = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, name, id):
+        self.keys.append(name.lower())
+        self.ids.append(id)
+
+    def sort(self):
+        order = sorted(range(len(self.keys)), key=self.keys.__getitem__)
+        self.keys = [self.keys[i] for i in order]
+        self.ids = [self.ids[i] for i in order]
+
+    def clear(self):
+        self.keys = []
+        self.ids = []
+
+    def insert(self, name, id):
+        key = name.lower()
+        i = bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.ids.insert(i, id)
+
+    def get(self, name):
+        name = name.lower()
+        lo = bisect_left(self.keys, name)
+        hi = bisect_right(self.keys, name, lo)
+        return self.ids[lo:hi]
+
+    def prefix(self, prefix):
+        prefix = prefix.lower()
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + "\U0010ffff", lo)
+        return self.ids[lo:hi]
+
+
+def read_rows(filename, *columns):
+    """
+    Yields the given columns of each row of a CSV file with a header,
+    reading one row at a time.
+    """
+    with open(filename, encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        indices = [header.index(column) for column in columns]
+        for row in reader:
+            yield tuple(row[i] for i in indices)
@@ -1,7 +1,10 @@
 import csv
 import itertools
+import string
 import sys
 
+import numpy as np
+
 PROBS = {
 
     # Unconditional probabilities for having gene
@@ -36,6 +39,17 @@ PROBS = {
     "mutation": 0.01
 }
 
+# Assignments of genes and traits evaluated at a time by `enumerate_probabilities`
+BATCH_SIZE = 1 << 14
+
+# Default number of samples drawn by approximate inference
+SAMPLES = 10000
+
+# Gibbs sampling runs this many chains side by side, and discards the
+# first BURN_IN sweeps of each
+CHAINS = 64
+BURN_IN = 50
+
 
 def main():
     # # Check for proper usage
@@ -45,44 +59,8 @@ def main():
 
     people = load_data("data/family0.csv")
 
-    # Keep track of gene and trait probabilities for each person
-    probabilities = {
-        person: {
-            "gene": {
-                2: 0,
-                1: 0,
-                0: 0
-            },
-            "trait": {
-                True: 0,
-                False: 0
-            }
-        }
-        for person in people
-    }
-
-    # Loop over all sets of people who might have the trait
-    names = set(people)
-    for have_trait in powerset(names):
-
-        # Check if current set of people violates known information
-        fails_evidence = any(
-            (people[person]["trait"] is not None and
-             people[person]["trait"] != (person in have_trait))
-            for person in names
-        )
-        if fails_evidence:
-            continue
-
-        # Loop over all sets of people who might have the gene
-        for one_gene in powerset(names):
-            for two_genes in powerset(names - one_gene):
-                # Update probabilities with new joint probability
-                p = joint_probability(people, one_gene, two_genes, have_trait)
-                update(probabilities, one_gene, two_genes, have_trait, p)
-
-    # Ensure probabilities sum to 1
-    normalize(probabilities)
+    # Gene and trait probabilities for each person, by variable elimination
+    probabilities = infer_probabilities(people)
 
     # Print results
     for person in people:
@@ -143,13 +121,11 @@ def joint_probability(people, one_gene, two_genes, have_trait):
     p_gene = None
     for person in people.values():
         num_of_genes = get_num_of_genes(person, one_gene, two_genes)
-        print("PERSON: ", person, "   ", "NUM OF GENES: ", num_of_genes, "\n")
 
         if person["mother"] and person["father"]:
             num_of_genes_mother = get_num_of_genes(people.get(person["mother"]), one_gene, two_genes)
             num_of_genes_father = get_num_of_genes(people.get(person["father"]), one_gene, two_genes)
 
-            print("NUM GENES MOTHER: ", num_of_genes_mother, "NUM GENES FATHER: ", num_of_genes_father, "\n")
             if num_of_genes == 0:
                 p_gene = (1 - prop_inherit(num_of_genes_mother)) * (1 - prop_inherit(num_of_genes_father))
             elif num_of_genes == 1:
@@ -157,28 +133,22 @@ def joint_probability(people, one_gene, two_genes, have_trait):
                     prop_inherit(num_of_genes_father) * (1 - prop_inherit(num_of_genes_mother))
             elif num_of_genes == 2:
                 p_gene = prop_inherit(num_of_genes_mother) * prop_inherit(num_of_genes_father)
-
-            print("PROB GENE: ", p_gene, "\n")
         else:
             p_gene = PROBS["gene"][num_of_genes]
-            print("NO PARENT gene: ", p_gene)
 
         has_trait = False
         if person["name"] in have_trait:
             has_trait = True
 
         p_trait = PROBS["trait"][num_of_genes][has_trait]
-        print("  trait: ", p_trait)
 
         p *= p_gene * p_trait
 
-    print("FINAL P: ", p, "\n")
     return p
 
 
 def prop_inherit(parent_num):
     c = 1 if parent_num == 0 else -1
-    print("PROB OF INHERITANCE: ", parent_num / 2 + c * PROBS["mutation"], "\n")
     return parent_num / 2 + c * PROBS["mutation"]
 
 
@@ -231,5 +201,419 @@ def normalize(probabilities):
             probabilities[person]["trait"][trait] = probabilities[person]["trait"][trait] / total
 
 
+def family_tables(people):
+    """
+    Return the conditional probability tables of a family as arrays:
+    the list of names, for every person the indices of their mother and
+    father (-1 for both unless both are known), the known traits (-1 if
+    unknown), the probabilities of a gene count without known parents
+    and given the parents' counts (see `inheritance_table`), and the
+    probability of each trait given each gene count.
+    """
+    names = list(people)
+    index = {name: i for i, name in enumerate(names)}
+    has_parents = [bool(people[name]["mother"] and people[name]["father"]) for name in names]
+    mothers = np.array([index[people[name]["mother"]] if known else -1
+                        for name, known in zip(names, has_parents)], dtype=np.intp)
+    fathers = np.array([index[people[name]["father"]] if known else -1
+                        for name, known in zip(names, has_parents)], dtype=np.intp)
+    traits = np.array([-1 if people[name]["trait"] is None else int(people[name]["trait"])
+                       for name in names], dtype=np.intp)
+    gene = np.array([PROBS["gene"][genes] for genes in range(3)])
+    trait = np.array([[PROBS["trait"][genes][False], PROBS["trait"][genes][True]]
+                      for genes in range(3)])
+    return names, mothers, fathers, traits, gene, inheritance_table(), trait
+
+
+def joint_probabilities(tables, genes, traits):
+    """
+    Return the joint probability of each of a batch of assignments, the
+    rows of `genes` (everyone's gene count) and `traits` (whether
+    everyone has the trait), as `joint_probability` computes it for one.
+    `tables` are the `family_tables` of the family.
+    """
+    _, mothers, fathers, _, gene, inheritance, trait = tables
+    children = np.flatnonzero(mothers >= 0)
+    founders = np.flatnonzero(mothers < 0)
+    p = gene[genes[:, founders]].prod(axis=1)
+    p *= inheritance[genes[:, children],
+                     genes[:, mothers[children]],
+                     genes[:, fathers[children]]].prod(axis=1)
+    p *= trait[genes, traits.astype(np.intp)].prod(axis=1)
+    return p
+
+
+def enumerate_probabilities(people, batch_size=BATCH_SIZE):
+    """
+    Return the gene and trait probability distributions of every person
+    like `infer_probabilities`, but by adding up the joint probability
+    of every assignment of gene counts and unknown traits as `main` once
+    did, `batch_size` assignments at a time with NumPy.
+    """
+    tables = family_tables(people)
+    names, _, _, known, _, _, _ = tables
+    n = len(names)
+    unknown = np.flatnonzero(known < 0)
+    gene_powers = 3 ** np.arange(n, dtype=np.int64)
+    trait_powers = 2 ** np.arange(len(unknown), dtype=np.int64)
+    combinations = 3 ** n * 2 ** len(unknown)
+
+    gene_totals = np.zeros((n, 3))
+    trait_totals = np.zeros(n)
+    for start in range(0, combinations, batch_size):
+        k = np.arange(start, min(start + batch_size, combinations), dtype=np.int64)
+        genes = (k[:, None] % 3 ** n) // gene_powers % 3
+        traits = np.broadcast_to(known == 1, (len(k), n)).copy()
+        traits[:, unknown] = (k[:, None] // 3 ** n) // trait_powers % 2 == 1
+        p = joint_probabilities(tables, genes, traits)
+        for genes_count in range(3):
+            gene_totals[:, genes_count] += p @ (genes == genes_count)
+        trait_totals += p @ traits
+
+    total = gene_totals[0].sum()
+    return {
+        name: {
+            "gene": {g: float(gene_totals[i, g] / total) for g in (2, 1, 0)},
+            "trait": {True: float(trait_totals[i] / total),
+                      False: float(1 - trait_totals[i] / total)},
+        }
+        for i, name in enumerate(names)
+    }
+
+
+def weighted_probabilities(people, samples=SAMPLES, seed=None, report=None):
+    """
+    Return the gene and trait probability distributions of every person
+    like `infer_probabilities`, estimated by likelihood weighting from
+    `samples` samples, drawn `BATCH_SIZE` at a time.
+
+    Everyone's gene count is drawn from their parents' (parents first),
+    and each sample is weighted by the probability of the known traits
+    given its gene counts. Unknown traits are not drawn: their
+    probability given the sampled gene count is averaged instead. With
+    many known traits nearly all the weight falls on a few samples, and
+    `gibbs_probabilities` is more accurate.
+
+    If `report` is given, it is called after every batch with the number
+    of samples drawn so far and the largest change of any estimated
+    probability since the last batch.
+    """
+    tables = family_tables(people)
+    names, mothers, fathers, known, gene, inheritance, trait = tables
+    rng = np.random.default_rng(seed)
+    order = parents_first(mothers, fathers)
+    n = len(names)
+
+    gene_totals = np.zeros((n, 3))
+    trait_totals = np.zeros(n)
+    total = 0
+    estimate = None
+    for start in range(0, samples, BATCH_SIZE):
+        size = min(BATCH_SIZE, samples - start)
+        genes = np.empty((size, n), dtype=np.intp)
+        weights = np.ones(size)
+        for i in order:
+            if mothers[i] < 0:
+                distribution = gene
+            else:
+                distribution = inheritance[:, genes[:, mothers[i]], genes[:, fathers[i]]].T
+            genes[:, i] = draw(distribution, size, rng)
+            if known[i] >= 0:
+                weights *= trait[genes[:, i], known[i]]
+        for genes_count in range(3):
+            gene_totals[:, genes_count] += weights @ (genes == genes_count)
+        trait_totals += weights @ trait[genes, 1]
+        total += weights.sum()
+        estimate = report_estimate(gene_totals / total, estimate, start + size, report)
+
+    return sampled_probabilities(names, known, gene_totals / total, trait_totals / total)
+
+
+def gibbs_probabilities(people, samples=SAMPLES, seed=None, report=None,
+                        chains=CHAINS, burn_in=BURN_IN):
+    """
+    Return the gene and trait probability distributions of every person
+    like `infer_probabilities`, estimated by Gibbs sampling from at
+    least `samples` samples.
+
+    `chains` assignments of gene counts are drawn from the parents, then
+    repeatedly swept: each person's gene count in turn is drawn again
+    given everyone else's, which only involves their parents, their
+    known trait and their children with the children's other parents.
+    After `burn_in` sweeps, each sweep adds one sample per chain; the
+    distribution each gene count was drawn from is averaged rather than
+    the drawn count itself.
+
+    If `report` is given, it is called after every sweep past the burn
+    in like in `weighted_probabilities`.
+    """
+    tables = family_tables(people)
+    names, mothers, fathers, known, gene, inheritance, trait = tables
+    rng = np.random.default_rng(seed)
+    order = parents_first(mothers, fathers)
+    n = len(names)
+
+    children = [[] for _ in names]
+    for child in np.flatnonzero(mothers >= 0):
+        children[mothers[child]].append((child, True))
+        children[fathers[child]].append((child, False))
+
+    genes = np.empty((chains, n), dtype=np.intp)
+    for i in order:
+        if mothers[i] < 0:
+            distribution = gene
+        else:
+            distribution = inheritance[:, genes[:, mothers[i]], genes[:, fathers[i]]].T
+        genes[:, i] = draw(distribution, chains, rng)
+
+    counts = np.arange(3)
+    gene_totals = np.zeros((n, 3))
+    drawn = 0
+    estimate = None
+    sweeps = burn_in + -(-samples // chains)
+    for sweep in range(sweeps):
+        for i in order:
+            if mothers[i] < 0:
+                distribution = np.tile(gene, (chains, 1))
+            else:
+                distribution = inheritance[:, genes[:, mothers[i]], genes[:, fathers[i]]].T
+            if known[i] >= 0:
+                distribution = distribution * trait[:, known[i]]
+            for child, is_mother in children[i]:
+                other = genes[:, fathers[child] if is_mother else mothers[child]][:, None]
+                own = genes[:, child][:, None]
+                if is_mother:
+                    distribution = distribution * inheritance[own, counts, other]
+                else:
+                    distribution = distribution * inheritance[own, other, counts]
+            distribution = distribution / distribution.sum(axis=1, keepdims=True)
+            genes[:, i] = draw(distribution, chains, rng)
+            if sweep >= burn_in:
+                gene_totals[i] += distribution.sum(axis=0)
+        if sweep >= burn_in:
+            drawn += chains
+            estimate = report_estimate(gene_totals / drawn, estimate, drawn, report)
+
+    genes_probabilities = gene_totals / drawn
+    return sampled_probabilities(names, known, genes_probabilities,
+                                 genes_probabilities @ trait[:, 1])
+
+
+def parents_first(mothers, fathers):
+    """
+    Return the indices of a family's people in an order that puts
+    everyone after their parents.
+    """
+    order = []
+    placed = set()
+
+    def place(i):
+        if i in placed:
+            return
+        placed.add(i)
+        if mothers[i] >= 0:
+            place(mothers[i])
+            place(fathers[i])
+        order.append(i)
+
+    for i in range(len(mothers)):
+        place(i)
+    return order
+
+
+def draw(distribution, size, rng):
+    """
+    Return `size` gene counts drawn from `distribution`, either one
+    distribution over 0, 1 and 2 copies for all or one row per draw.
+    """
+    cumulative = np.cumsum(distribution, axis=-1)
+    u = rng.random(size) * cumulative[..., -1]
+    return (u[:, None] >= np.broadcast_to(cumulative, (size, 3))[:, :2]).sum(axis=1)
+
+
+def report_estimate(estimate, previous, drawn, report):
+    """
+    Call `report`, if given, with the number of samples `drawn` and the
+    largest change from `previous` to `estimate`. Return `estimate`.
+    """
+    if report is not None:
+        change = float("inf") if previous is None else float(np.abs(estimate - previous).max())
+        report(drawn, change)
+    return estimate.copy()
+
+
+def sampled_probabilities(names, known, genes, traits):
+    """
+    Return estimated gene distributions `genes` (one row of probabilities
+    of 0, 1 and 2 copies per person) and trait probabilities `traits` in
+    the form of `infer_probabilities`, keeping known traits certain.
+    """
+    probabilities = dict()
+    for i, name in enumerate(names):
+        has_trait = float(known[i]) if known[i] >= 0 else float(traits[i])
+        probabilities[name] = {
+            "gene": {g: float(genes[i, g]) for g in (2, 1, 0)},
+            "trait": {True: has_trait, False: 1 - has_trait},
+        }
+    return probabilities
+
+
+def infer_probabilities(people):
+    """
+    Return the gene and trait probability distributions of every person
+    given the known traits, in the same form as the normalized
+    `probabilities` that `update` and `normalize` produce by enumerating
+    every combination of genes and traits.
+
+    Only the gene counts are unknowns: each person adds one factor over
+    their own gene count and their parents' (the probability of their
+    gene count given their parents', times the probability of their
+    known trait). Summing people out of the product of these factors one
+    at a time (variable elimination) and passing the sums back again
+    gives everyone's distribution, in time linear in the size of the
+    family for pedigrees without many intermarriages.
+    """
+    genes = gene_distributions(family_factors(people))
+    probabilities = dict()
+    for person in people:
+        gene = genes[person]
+        trait = people[person]["trait"]
+        if trait is None:
+            has_trait = sum(gene[g] * PROBS["trait"][g][True] for g in range(3))
+        else:
+            has_trait = float(trait)
+        probabilities[person] = {
+            "gene": {g: float(gene[g]) for g in (2, 1, 0)},
+            "trait": {True: has_trait, False: 1 - has_trait},
+        }
+    return probabilities
+
+
+def inheritance_table():
+    """
+    Return an array whose entry [child, mother, father] is the
+    probability that a child has `child` copies of the gene given that
+    their mother and father have `mother` and `father` copies.
+    """
+    passed = np.array([prop_inherit(genes) for genes in range(3)])
+    kept = 1 - passed
+    table = np.empty((3, 3, 3))
+    table[0] = np.outer(kept, kept)
+    table[1] = np.outer(passed, kept) + np.outer(kept, passed)
+    table[2] = np.outer(passed, passed)
+    return table
+
+
+def family_factors(people):
+    """
+    Return a list of (names, table) factors whose product is the joint
+    probability of everyone's gene count and known trait. `table` has one
+    axis of size 3 (gene count) per name in `names`.
+    """
+    inheritance = inheritance_table()
+    factors = []
+    for person in people.values():
+        trait = person["trait"]
+        likelihood = np.array([
+            1 if trait is None else PROBS["trait"][genes][trait]
+            for genes in range(3)
+        ])
+        if person["mother"] and person["father"]:
+            names = (person["name"], person["mother"], person["father"])
+            table = inheritance * likelihood[:, None, None]
+        else:
+            names = (person["name"],)
+            table = np.array([PROBS["gene"][genes] for genes in range(3)]) * likelihood
+        factors.append((names, table))
+    return factors
+
+
+def elimination_order(factors):
+    """
+    Return every name in `factors` in an order to sum them out that
+    keeps the intermediate factors small: repeatedly the name whose
+    elimination joins the fewest other names (min-degree).
+    """
+    neighbors = dict()
+    for names, _ in factors:
+        for name in names:
+            neighbors.setdefault(name, set()).update(names)
+    for name in neighbors:
+        neighbors[name].discard(name)
+
+    order = []
+    while neighbors:
+        name = min(neighbors, key=lambda name: len(neighbors[name]))
+        joined = neighbors.pop(name)
+        for other in joined:
+            neighbors[other] |= joined - {other}
+            neighbors[other].discard(name)
+        order.append(name)
+    return order
+
+
+def gene_distributions(factors):
+    """
+    Return a dictionary mapping every name in `factors` to the
+    normalized distribution of its gene count under their product.
+
+    Names are summed out in `elimination_order`. Eliminating a name
+    joins the factors that mention it into a cluster and sends the sum
+    over the name on to the cluster of a later name (collect). Then each
+    cluster sends back, over the same links, the sum of everything
+    else (distribute), after which every cluster holds the distribution
+    of its own name.
+    """
+    order = elimination_order(factors)
+    position = {name: i for i, name in enumerate(order)}
+
+    # Each factor belongs to the cluster of the first of its names to go
+    local = [[] for _ in order]
+    for factor in factors:
+        local[min(position[name] for name in factor[0])].append(factor)
+
+    children = [[] for _ in order]
+    parent = [None] * len(order)
+    up = [None] * len(order)
+    for i, name in enumerate(order):
+        incoming = local[i] + [up[child] for child in children[i]]
+        up[i] = multiply(incoming, keep=lambda other: other != name)
+        if up[i][0]:
+            parent[i] = min(position[other] for other in up[i][0])
+            children[parent[i]].append(i)
+
+    down = [None] * len(order)
+    distributions = dict()
+    for i in reversed(range(len(order))):
+        incoming = local[i] + [up[child] for child in children[i]]
+        if down[i] is not None:
+            incoming.append(down[i])
+        for child in children[i]:
+            separator = set(up[child][0])
+            down[child] = multiply([factor for factor in incoming if factor is not up[child]],
+                                   keep=separator.__contains__)
+        gene = multiply(incoming, keep=lambda other: other == order[i])[1]
+        distributions[order[i]] = gene / gene.sum()
+    return distributions
+
+
+def multiply(factors, keep):
+    """
+    Return the product of `factors` as one factor, summing out every
+    name for which `keep` is false. The product of no factors is 1.
+    """
+    if not factors:
+        return (), np.ones(())
+    letters = dict()
+    for names, _ in factors:
+        for name in names:
+            letters.setdefault(name, string.ascii_letters[len(letters)])
+    names = tuple(name for name in letters if keep(name))
+    inputs = ",".join("".join(letters[name] for name in factor_names)
+                      for factor_names, _ in factors)
+    output = "".join(letters[name] for name in names)
+    return names, np.einsum(f"{inputs}->{output}", *(table for _, table in factors))
+
+
 if __name__ == "__main__":
     main()
@@ -6,7 +6,22 @@ Make sure that this file is in the same directory as heredity.py!
 'Why do we fall sir? So that we can learn to pick ourselves up.'
                                         - Batman Begins (2005)
 """
-from heredity import joint_probability, load_data, normalize, powerset, update
+import numpy as np
+import pytest as pt
+
+from heredity import (
+    enumerate_probabilities,
+    family_tables,
+    gibbs_probabilities,
+    infer_probabilities,
+    joint_probabilities,
+    joint_probability,
+    load_data,
+    normalize,
+    powerset,
+    update,
+    weighted_probabilities,
+)
 
 PRECISION = 4
 
@@ -98,6 +113,89 @@ def test_family2():
     return compare(predicted, expected)
 
 
+@pt.mark.parametrize("n", range(3))
+def test_infer_vs_enumerate(n):
+    predicted = infer_probabilities(load_data(f"data/family{n}.csv"))
+    enumerated = predict_family(n)
+    for person, fields in enumerated.items():
+        for field, values in fields.items():
+            for value, p in values.items():
+                assert predicted[person][field][value] == pt.approx(p, abs=1e-12)
+
+
+@pt.mark.parametrize("n", range(3))
+def test_batched_enumeration_vs_enumerate(n):
+    predicted = enumerate_probabilities(load_data(f"data/family{n}.csv"), batch_size=7)
+    enumerated = predict_family(n)
+    for person, fields in enumerated.items():
+        for field, values in fields.items():
+            for value, p in values.items():
+                assert predicted[person][field][value] == pt.approx(p, abs=1e-12)
+
+
+def test_joint_probabilities():
+    people = load_data("data/family1.csv")
+    tables = family_tables(people)
+    names = tables[0]
+    genes = np.array([[0, 1, 2, 0, 1, 2], [2, 2, 1, 0, 0, 1], [1, 0, 0, 0, 2, 1]])
+    traits = np.array([[False, True, False, True, False, True],
+                       [True, False, False, False, True, False],
+                       [False, False, True, False, False, False]])
+    batch = joint_probabilities(tables, genes, traits)
+    for row in range(len(genes)):
+        one_gene = {name for name, g in zip(names, genes[row]) if g == 1}
+        two_genes = {name for name, g in zip(names, genes[row]) if g == 2}
+        have_trait = {name for name, t in zip(names, traits[row]) if t}
+        p = joint_probability(people, one_gene, two_genes, have_trait)
+        assert batch[row] == pt.approx(p, rel=1e-12)
+
+
+def test_infer_large_family():
+    # ten generations of cousins marrying in, with some traits known
+    people = {
+        name: {"name": name, "mother": None, "father": None, "trait": None}
+        for name in ("A0", "B0")
+    }
+    for generation in range(1, 11):
+        for name, mother, father in ((f"A{generation}", f"A{generation - 1}", f"B{generation - 1}"),
+                                     (f"B{generation}", f"A{generation - 1}", f"B{generation - 1}"),
+                                     (f"C{generation}", f"B{generation}", f"A{generation}")):
+            people[name] = {"name": name, "mother": mother, "father": father,
+                            "trait": generation % 3 == 0 if name[0] == "C" else None}
+    probabilities = infer_probabilities(people)
+    for person in people:
+        assert sum(probabilities[person]["gene"].values()) == pt.approx(1)
+        assert sum(probabilities[person]["trait"].values()) == pt.approx(1)
+    assert probabilities["C3"]["trait"][True] == 1
+    assert probabilities["C3"]["gene"][0] < probabilities["C1"]["gene"][0]
+
+
+@pt.mark.parametrize("sample", [weighted_probabilities, gibbs_probabilities])
+@pt.mark.parametrize("n", range(3))
+def test_sample_vs_infer(sample, n):
+    people = load_data(f"data/family{n}.csv")
+    predicted = sample(people, samples=50000, seed=n)
+    exact = infer_probabilities(people)
+    for person, fields in exact.items():
+        for field, values in fields.items():
+            for value, p in values.items():
+                assert predicted[person][field][value] == pt.approx(p, abs=0.02)
+
+
+@pt.mark.parametrize("sample", [weighted_probabilities, gibbs_probabilities])
+def test_sample_seeded(sample):
+    people = load_data("data/family1.csv")
+    assert sample(people, samples=1000, seed=1) == sample(people, samples=1000, seed=1)
+
+
+def test_sample_report():
+    reports = []
+    gibbs_probabilities(load_data("data/family2.csv"), samples=640, seed=1, chains=64,
+                        report=lambda drawn, change: reports.append((drawn, change)))
+    assert [drawn for drawn, _ in reports] == list(range(64, 641, 64))
+    assert all(0 <= change < 1 for _, change in reports[1:])
+
+
 # Helper functions
 
 
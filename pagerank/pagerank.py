@@ -1,21 +1,102 @@
+import argparse
+import multiprocessing
 import os
 import random
 import re
+import struct
 import sys
+import tempfile
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
 
 DAMPING = 0.85
 SAMPLES = 10000
 
+# Number of random surfers simulated together by batch sampling
+SURFERS = 4096
+
+# Surfers walk until their start page has less than this much influence
+# (in total variation) before their visits are counted
+BURN_IN_BIAS = 1e-4
+
+# Characters read from an HTML file at a time while crawling
+CHUNK_SIZE = 1 << 16
+
+# Longest unfinished tag carried from one chunk to the next
+MAX_TAG = 1 << 16
+
+# Index of the links in a corpus, kept in the corpus directory
+INDEX = "pagerank.index.npz"
+INDEX_VERSION = 1
+
+# Edge file for out-of-core ranking, kept in the corpus directory
+EDGES = "pagerank.edges"
+EDGES_MAGIC = b"PREDGES1"
+EDGES_HEADER = struct.Struct("<8sqqq")
+
+# Links handled at a time when writing or streaming an edge file
+CHUNK_EDGES = 1 << 20
+
+LINK = re.compile(r"<a\s+(?:[^>]*?)href=\"([^\"]*)\"")
+
+# Link graph inherited by sampling worker processes
+worker_graph = None
+
+# Power iteration stops once the ranks change by less than this in total
+TOLERANCE = 1e-10
+MAX_ITERATIONS = 1000
+
+# Ways to iterate towards the ranks, see `solve_pagerank`
+METHODS = ("power", "gauss-seidel", "aitken", "quadratic")
+
+# Iterations between two extrapolations
+EXTRAPOLATION_PERIOD = 10
+
 
 def main():
-    if len(sys.argv) != 2:
-        sys.exit("Usage: python pagerank.py corpus")
-    corpus = crawl(sys.argv[1])
-    ranks = sample_pagerank(corpus, DAMPING, SAMPLES)
-    print(f"PageRank Results from Sampling (n = {SAMPLES})")
+    parser = argparse.ArgumentParser(prog="python pagerank.py")
+    parser.add_argument("corpus")
+    parser.add_argument("--samples", type=int, default=SAMPLES)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="total (L1) change at which iteration stops")
+    parser.add_argument("--seed", type=int, help="seed for reproducible sampling")
+    parser.add_argument("--surfers", type=int,
+                        help="simulate this many surfers at once with NumPy")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="split sampling across this many processes")
+    parser.add_argument("--method", choices=METHODS, default="power",
+                        help="how to iterate towards the ranks")
+    parser.add_argument("--report", action="store_true",
+                        help="print the residual and time of every iteration")
+    parser.add_argument("--out-of-core", action="store_true",
+                        help="only iterate, streaming the links from a file on disk")
+    args = parser.parse_args()
+
+    if args.out_of_core:
+        edges = EdgeFile.build(args.corpus, os.path.join(args.corpus, EDGES))
+        ranks = stream_pagerank(edges, DAMPING, args.tolerance,
+                                report=print_iteration if args.report else None)
+        print(f"PageRank Results from Iteration")
+        for page in sorted(ranks):
+            print(f"  {page}: {ranks[page]:.4f}")
+        return
+
+    corpus = index_crawl(args.corpus)
+    if args.workers > 1:
+        ranks = parallel_sample_pagerank(corpus, DAMPING, args.samples, args.workers,
+                                         args.surfers or SURFERS, args.seed)
+    elif args.surfers:
+        ranks = batch_sample_pagerank(corpus, DAMPING, args.samples, args.surfers, args.seed)
+    else:
+        ranks = table_sample_pagerank(corpus, DAMPING, args.samples, args.seed)
+    print(f"PageRank Results from Sampling (n = {args.samples})")
     for page in sorted(ranks):
         print(f"  {page}: {ranks[page]:.4f}")
-    ranks = iterate_pagerank(corpus, DAMPING)
+    ranks = solve_pagerank(corpus, DAMPING, args.method, args.tolerance,
+                           report=print_iteration if args.report else None)
     print(f"PageRank Results from Iteration")
     for page in sorted(ranks):
         print(f"  {page}: {ranks[page]:.4f}")
@@ -48,6 +129,162 @@ def crawl(directory):
     return pages
 
 
+def stream_crawl(directory, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Like `crawl`, but parses the HTML files concurrently on `workers`
+    threads and reads each one `chunk_size` characters at a time, so a
+    file is never held in memory whole.
+
+    Page names are interned and every link refers to the same string as
+    the page it names, so a page is stored once however often it is
+    linked to.
+    """
+    filenames = [
+        sys.intern(entry.name) for entry in os.scandir(directory)
+        if entry.name.endswith(".html") and entry.is_file()
+    ]
+    with ThreadPoolExecutor(workers) as executor:
+        found = executor.map(
+            lambda filename: read_links(os.path.join(directory, filename), chunk_size),
+            filenames)
+        return link_pages(zip(filenames, found))
+
+
+def index_crawl(directory, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Like `stream_crawl`, but remembers the links of every file in an
+    index file in `directory` and only parses files that are new or whose
+    modification time or size changed since the index was written.
+    The index is rewritten whenever it is out of date.
+    """
+    path = os.path.join(directory, INDEX)
+    try:
+        indexed = load_index(path)
+    except (OSError, ValueError, KeyError):
+        indexed = dict()
+
+    files = dict()
+    stale = []
+    for entry in os.scandir(directory):
+        if not entry.name.endswith(".html") or not entry.is_file():
+            continue
+        filename = sys.intern(entry.name)
+        stat = entry.stat()
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if filename in indexed and indexed[filename][0] == stamp:
+            files[filename] = indexed[filename]
+        else:
+            files[filename] = (stamp, None)
+            stale.append(filename)
+
+    with ThreadPoolExecutor(workers) as executor:
+        found = executor.map(
+            lambda filename: read_links(os.path.join(directory, filename), chunk_size),
+            stale)
+        for filename, links in zip(stale, found):
+            files[filename] = (files[filename][0], links)
+
+    if stale or len(files) != len(indexed):
+        try:
+            save_index(path, files)
+        except OSError:
+            pass
+    return link_pages((filename, links) for filename, (_, links) in files.items())
+
+
+def load_index(path):
+    """
+    Read the index at `path`. Return a dictionary mapping each file name
+    to its (modification time, size) and the set of all link targets in
+    the file, including ones outside the corpus.
+    """
+    with np.load(path, allow_pickle=False) as index:
+        if int(index["version"]) != INDEX_VERSION:
+            raise ValueError("unsupported index version")
+        pages = index["pages"].tolist()
+        mtimes = index["mtimes"].tolist()
+        sizes = index["sizes"].tolist()
+        targets = [sys.intern(target) for target in index["targets"].tolist()]
+        indptr = index["indptr"].tolist()
+        indices = index["indices"].tolist()
+    return {
+        sys.intern(page): (
+            (mtimes[i], sizes[i]),
+            {targets[j] for j in indices[indptr[i]:indptr[i + 1]]},
+        )
+        for i, page in enumerate(pages)
+    }
+
+
+def save_index(path, files):
+    """
+    Write the file stamps and links in `files`, as returned by
+    `load_index`, to `path`.
+    """
+    pages = list(files)
+    targets = sorted(set().union(*(links for _, links in files.values())))
+    number = {target: j for j, target in enumerate(targets)}
+    indptr = [0]
+    indices = []
+    for page in pages:
+        indices.extend(sorted(number[link] for link in files[page][1]))
+        indptr.append(len(indices))
+
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        np.savez(
+            f,
+            version=INDEX_VERSION,
+            pages=np.array(pages, dtype=str),
+            mtimes=np.array([files[page][0][0] for page in pages], dtype=np.int64),
+            sizes=np.array([files[page][0][1] for page in pages], dtype=np.int64),
+            targets=np.array(targets, dtype=str),
+            indptr=np.array(indptr, dtype=np.int64),
+            indices=np.array(indices, dtype=np.int64),
+        )
+    os.replace(temporary, path)
+
+
+def link_pages(found):
+    """
+    Return the corpus dictionary for (page, links) pairs in `found`,
+    keeping only links to other pages in the corpus. Links refer to the
+    same string objects as the pages they name.
+    """
+    found = dict(found)
+    names = {filename: filename for filename in found}
+    return {
+        filename: {
+            names[link] for link in links
+            if link in names and link != filename
+        }
+        for filename, links in found.items()
+    }
+
+
+def read_links(path, chunk_size=CHUNK_SIZE):
+    """
+    Return the set of link targets in the HTML file at `path`, reading it
+    `chunk_size` characters at a time.
+
+    Text after the last complete link that may still hold the start of
+    one (from its last "<") is carried over to the next chunk, up to
+    MAX_TAG characters.
+    """
+    links = set()
+    tail = ""
+    with open(path) as f:
+        while chunk := f.read(chunk_size):
+            text = tail + chunk
+            end = 0
+            for match in LINK.finditer(text):
+                links.add(match.group(1))
+                end = match.end()
+            start = text.rfind("<", end)
+            tail = text[start:] if start >= 0 and len(text) - start <= MAX_TAG else ""
+    return links
+
+
 def transition_model(corpus, page, damping_factor):
     """
     Return a probability distribution over which page to visit next,
@@ -84,6 +321,169 @@ def sample_pagerank(corpus, damping_factor, n):
     return {k: v/n for (k, v) in samples.items()}
 
 
+def transition_tables(corpus):
+    """
+    Return the sorted list of pages in `corpus` and, for each of them,
+    a tuple of the indices of the pages it links to.
+
+    Together with the damping factor this is the whole transition model:
+    the next page is one of these links, picked uniformly, with probability
+    `damping_factor`, and otherwise any page, picked uniformly. Pages
+    without links always move to any page.
+    """
+    pages = sorted(corpus)
+    index = {page: i for i, page in enumerate(pages)}
+    links = [
+        tuple(index[link] for link in corpus[page] if link in index and link != page)
+        for page in pages
+    ]
+    return pages, links
+
+
+def table_sample_pagerank(corpus, damping_factor, n, seed=None):
+    """
+    Return PageRank values for each page by sampling `n` pages, like
+    `sample_pagerank`, but drawing each next page in constant time from
+    tables built once by `transition_tables`.
+
+    Pass `seed` for reproducible results.
+    """
+    pages, links = transition_tables(corpus)
+    rng = random.Random(seed)
+    count = len(pages)
+    samples = [0] * count
+    page = rng.randrange(count)
+    for _ in range(n):
+        outgoing = links[page]
+        if outgoing and rng.random() < damping_factor:
+            page = outgoing[rng.randrange(len(outgoing))]
+        else:
+            page = rng.randrange(count)
+        samples[page] += 1
+    return {page: samples[i] / n for i, page in enumerate(pages)}
+
+
+def batch_sample_pagerank(corpus, damping_factor, n, surfers=SURFERS, seed=None):
+    """
+    Return PageRank values for each page by sampling `n` pages with
+    `surfers` independent random surfers that move in lockstep, each
+    step drawn for all of them at once with NumPy.
+
+    Pass `seed` for reproducible results.
+    """
+    graph = corpus if isinstance(corpus, LinkGraph) else LinkGraph.from_corpus(corpus)
+    counts = surf(graph, damping_factor, n, surfers, np.random.default_rng(seed))
+    return graph.ranks(counts / n)
+
+
+def surf(graph, damping_factor, n, surfers, rng):
+    """
+    Move `surfers` random surfers through `graph`, starting on random
+    pages, until `n` pages were visited in total, and return how many
+    times each page was visited.
+
+    Each surfer first walks uncounted until its start page no longer
+    biases where it is (BURN_IN_BIAS). There are never more surfers than
+    would spend at least as many steps counted as burning in.
+    """
+    count = len(graph)
+    visits = np.zeros(count, dtype=np.int64)
+    if damping_factor <= 0:
+        burn_in = 0
+    elif damping_factor >= 1:
+        burn_in = MAX_ITERATIONS
+    else:
+        burn_in = int(np.ceil(np.log(BURN_IN_BIAS) / np.log(damping_factor)))
+    surfers = max(1, min(surfers, n // max(burn_in, 1)))
+    positions = rng.integers(count, size=surfers)
+    for _ in range(burn_in):
+        positions = move(graph, positions, damping_factor, rng)
+
+    # visits are counted with bincount once enough have piled up,
+    # as one bincount per step would cost O(pages) each time
+    pending = []
+    pending_size = 0
+    remaining = n
+    while remaining > 0:
+        if remaining < len(positions):
+            positions = positions[:remaining]
+        size = len(positions)
+        positions = move(graph, positions, damping_factor, rng)
+
+        pending.append(positions)
+        pending_size += size
+        remaining -= size
+        if pending_size >= count or remaining == 0:
+            visits += np.bincount(np.concatenate(pending), minlength=count)
+            pending = []
+            pending_size = 0
+    return visits
+
+
+def move(graph, positions, damping_factor, rng):
+    """
+    Return the next page of every surfer currently at `positions`.
+    """
+    size = len(positions)
+    degree = graph.out_degree[positions]
+    follow = (rng.random(size) < damping_factor) & (degree > 0)
+    jump = rng.integers(len(graph), size=size)
+    if not follow.any():
+        return jump
+    pick = graph.out_indptr[positions] + (rng.random(size) * degree).astype(np.int64)
+    return np.where(follow, graph.out_indices[np.where(follow, pick, 0)], jump)
+
+
+def parallel_sample_pagerank(corpus, damping_factor, n, workers=None,
+                             surfers=SURFERS, seed=None):
+    """
+    Return PageRank values for each page by sampling `n` pages, split
+    evenly across `workers` processes (one per CPU by default) that each
+    run `surf` with their own independent random stream.
+
+    Pass `seed` for reproducible results with a given number of workers.
+    """
+    global worker_graph
+    graph = corpus if isinstance(corpus, LinkGraph) else LinkGraph.from_corpus(corpus)
+    workers = workers or os.cpu_count()
+    streams = np.random.SeedSequence(seed).spawn(workers)
+    shares = [n // workers + (i < n % workers) for i in range(workers)]
+
+    # Forked workers inherit the graph instead of unpickling a copy each
+    worker_graph = graph
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = None
+    try:
+        with ProcessPoolExecutor(workers, mp_context=context,
+                                 initializer=set_worker_graph,
+                                 initargs=(graph,)) as pool:
+            futures = [
+                pool.submit(surf_share, damping_factor, share, surfers, stream)
+                for share, stream in zip(shares, streams) if share
+            ]
+            visits = sum(future.result() for future in futures)
+    finally:
+        worker_graph = None
+    return graph.ranks(visits / n)
+
+
+def set_worker_graph(graph):
+    """
+    Make `graph` the link graph that `surf_share` samples in this process.
+    """
+    global worker_graph
+    worker_graph = graph
+
+
+def surf_share(damping_factor, n, surfers, stream):
+    """
+    Return the visit counts of one worker's share of the samples.
+    """
+    return surf(worker_graph, damping_factor, n, surfers, np.random.default_rng(stream))
+
+
 def iterate_pagerank(corpus, damping_factor):
     """
     Return PageRank values for each page by iteratively updating
@@ -93,26 +493,521 @@ def iterate_pagerank(corpus, damping_factor):
     their estimated PageRank value (a value between 0 and 1). All
     PageRank values should sum to 1.
     """
-    page_ranks = {k: 1/len(corpus) for k in corpus}
-    page_refs = {k: [] for k in corpus}
-    min_dif = 0.001
+    return solve_pagerank(corpus, damping_factor)
+
+
+class LinkGraph():
+    """
+    Link structure of a corpus as NumPy arrays, with pages numbered
+    in sorted order.
+
+    `in_indptr`, `in_indices` and `in_weights` hold the column-stochastic
+    link matrix M in CSR form: row i lists the pages j that link to page i,
+    each with weight 1 / (number of links on j). Pages without links are
+    marked in `dangling` and treated as linking to every page.
+
+    `out_indptr` and `out_indices` list the links of each page in the
+    same CSR form, for walking the graph forwards.
+    """
 
-    for page in corpus:
-        for ref, links in corpus.items():
-            if ref == page:
+    def __init__(self, pages, sources, destinations):
+        n = len(pages)
+        self.pages = pages
+        self.index = {page: i for i, page in enumerate(pages)}
+        self.out_degree = np.bincount(sources, minlength=n)
+        self.dangling = self.out_degree == 0
+
+        order = np.argsort(sources, kind="stable")
+        self.out_indices = destinations[order]
+        self.out_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(self.out_degree, out=self.out_indptr[1:])
+
+        order = np.argsort(destinations, kind="stable")
+        self.in_indices = sources[order]
+        self.in_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(destinations, minlength=n), out=self.in_indptr[1:])
+        self.in_weights = 1 / self.out_degree[self.in_indices]
+
+        # start of each row that has any links, for np.add.reduceat
+        rows = self.in_indptr[:-1] < self.in_indptr[1:]
+        self.linked_rows = np.flatnonzero(rows)
+        self.row_starts = self.in_indptr[:-1][rows]
+
+    @classmethod
+    def from_corpus(cls, corpus):
+        """
+        Build the link graph of a corpus as returned by `crawl`.
+        Links to pages outside the corpus are ignored.
+        """
+        pages = sorted(corpus)
+        index = {page: i for i, page in enumerate(pages)}
+        sources = []
+        destinations = []
+        for page in pages:
+            for link in corpus[page]:
+                if link in index and link != page:
+                    sources.append(index[page])
+                    destinations.append(index[link])
+        return cls(pages,
+                   np.array(sources, dtype=np.int64),
+                   np.array(destinations, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.pages)
+
+    def matvec(self, x):
+        """
+        Return M x, the rank each page receives through links.
+        """
+        y = np.zeros(len(self.pages))
+        if len(self.in_indices):
+            contributions = self.in_weights * x[self.in_indices]
+            y[self.linked_rows] = np.add.reduceat(contributions, self.row_starts)
+        return y
+
+    def matmat(self, x):
+        """
+        Return (M x^T)^T for a matrix `x` with one row of ranks per
+        ranking. Rows are multiplied one at a time: gathering the whole
+        matrix per link at once is slower, as it does not fit in cache.
+        """
+        y = np.empty_like(x)
+        for row, ranks in enumerate(x):
+            y[row] = self.matvec(ranks)
+        return y
+
+    def step(self, x, damping_factor):
+        """
+        Return the ranks after one step of the random surfer from ranks `x`.
+        """
+        n = len(self.pages)
+        followed = self.matvec(x) + x[self.dangling].sum() / n
+        return damping_factor * followed + (1 - damping_factor) / n
+
+    def ranks(self, x):
+        """
+        Return rank vector `x` as a dictionary keyed by page name.
+        """
+        return {page: float(x[i]) for i, page in enumerate(self.pages)}
+
+
+def sparse_pagerank(corpus, damping_factor, tolerance=TOLERANCE,
+                    max_iterations=MAX_ITERATIONS, start=None):
+    """
+    Return PageRank values for each page of `corpus` (a corpus dictionary
+    or a `LinkGraph`) by power iteration on the sparse link matrix,
+    until the ranks change by less than `tolerance` in total.
+
+    Iteration starts from the ranks in the dictionary `start` if given
+    (pages missing from it start at 1 / N), otherwise from 1 / N.
+
+    Return a dictionary where keys are page names, and values are
+    their estimated PageRank value (a value between 0 and 1). All
+    PageRank values should sum to 1.
+    """
+    return solve_pagerank(corpus, damping_factor, "power", tolerance,
+                          max_iterations, start)
+
+
+def solve_pagerank(corpus, damping_factor, method="power", tolerance=TOLERANCE,
+                   max_iterations=MAX_ITERATIONS, start=None, report=None):
+    """
+    Return PageRank values for each page of `corpus` (a corpus dictionary
+    or a `LinkGraph`), iterating with `method`, one of:
+
+      "power"         one step of the random surfer at a time
+      "gauss-seidel"  update pages in turn, each from the newest ranks
+      "aitken"        power iteration, extrapolating every page's rank
+                      from its last three values now and then
+      "quadratic"     power iteration, extrapolating from the last four
+                      rank vectors now and then (Kamvar et al.)
+
+    Iteration stops once one step of the random surfer changes the
+    ranks by less than `tolerance` in total (L1), or after
+    `max_iterations`. It starts from `start` as in `sparse_pagerank`.
+
+    If `report` is given, it is called after every iteration with the
+    iteration number, the total change and the seconds since the start.
+    """
+    if method not in METHODS:
+        raise ValueError(f"unknown method {method!r}")
+    graph = corpus if isinstance(corpus, LinkGraph) else LinkGraph.from_corpus(corpus)
+    if len(graph) == 0:
+        return dict()
+    x = np.full(len(graph), 1 / len(graph))
+    if start is not None:
+        for page, i in graph.index.items():
+            x[i] = start.get(page, x[i])
+        x /= x.sum()
+
+    history = []
+    begin = time.perf_counter()
+    for iteration in range(1, max_iterations + 1):
+        new = graph.step(x, damping_factor)
+        residual = np.abs(new - x).sum()
+        if report is not None:
+            report(iteration, residual, time.perf_counter() - begin)
+        if residual < tolerance:
+            x = new
+            break
+
+        if method == "gauss-seidel":
+            x = gauss_seidel_sweep(graph, x, damping_factor)
+            continue
+        x = new
+        if method == "power":
+            continue
+        history = history[-3:] + [x]
+        if iteration % EXTRAPOLATION_PERIOD == 0:
+            x = aitken(*history[-3:]) if method == "aitken" else quadratic(*history)
+            history = []
+    return graph.ranks(x)
+
+
+def gauss_seidel_sweep(graph, x, damping_factor):
+    """
+    Return the ranks after updating every page of `graph` in turn from
+    ranks `x`, using the pages already updated in this sweep.
+    """
+    n = len(graph)
+    x = x.tolist()
+    indptr = graph.in_indptr.tolist()
+    indices = graph.in_indices.tolist()
+    weights = graph.in_weights.tolist()
+    dangling = graph.dangling.tolist()
+    dangling_rank = sum(x[i] for i in range(n) if dangling[i])
+    for i in range(n):
+        followed = dangling_rank / n
+        for k in range(indptr[i], indptr[i + 1]):
+            followed += weights[k] * x[indices[k]]
+        new = damping_factor * followed + (1 - damping_factor) / n
+        if dangling[i]:
+            dangling_rank += new - x[i]
+        x[i] = new
+    x = np.array(x)
+    return x / x.sum()
+
+
+def aitken(x0, x1, x2):
+    """
+    Return the limit of every page's rank estimated by Aitken's delta
+    squared process from three successive rank vectors.
+    """
+    second = x2 - 2 * x1 + x0
+    safe = np.abs(second) > 1e-15
+    x = x2.copy()
+    x[safe] -= (x2 - x1)[safe] ** 2 / second[safe]
+    return normalized(x, x2)
+
+
+def quadratic(x0, x1, x2, x3):
+    """
+    Return the ranks estimated by quadratic extrapolation from four
+    successive rank vectors, assuming the error lies mostly along the
+    link matrix's second and third eigenvectors.
+    """
+    y = np.column_stack((x1 - x0, x2 - x0, x3 - x0))
+    gamma, *_ = np.linalg.lstsq(y[:, :2], -y[:, 2], rcond=None)
+    gamma = np.append(gamma, 1)
+    beta = gamma[::-1].cumsum()[::-1]
+    x = beta[0] * x1 + beta[1] * x2 + beta[2] * x3
+    return normalized(x, x3)
+
+
+def normalized(x, fallback):
+    """
+    Return extrapolated ranks `x` scaled to sum to 1, or `fallback` if
+    extrapolation made any of them negative or undefined.
+    """
+    if not np.isfinite(x).all() or (x < 0).any():
+        return fallback
+    return x / x.sum()
+
+
+def print_iteration(iteration, residual, seconds):
+    print(f"  iteration {iteration}: residual {residual:.3e} after {seconds:.3f}s")
+
+
+def personalized_pagerank(corpus, damping_factor, teleports, tolerance=TOLERANCE,
+                          max_iterations=MAX_ITERATIONS):
+    """
+    Return personalized PageRank values for each page of `corpus` (a
+    corpus dictionary or a `LinkGraph`) for every teleport distribution
+    in `teleports`, a dictionary mapping a name (such as a topic) to a
+    dictionary of page weights. A surfer who jumps, or who is on a page
+    without links, lands on a page chosen by these weights instead of
+    uniformly. Weights need not sum to 1.
+
+    All rankings are iterated together, one row of a matrix each, and
+    share the link graph. A ranking stops being updated once a step
+    changes it by less than `tolerance` in total.
+
+    Return a dictionary mapping each name to its PageRank values.
+    """
+    graph = corpus if isinstance(corpus, LinkGraph) else LinkGraph.from_corpus(corpus)
+    names = list(teleports)
+    v = np.zeros((len(names), len(graph)))
+    for row, name in enumerate(names):
+        for page, weight in teleports[name].items():
+            v[row, graph.index[page]] = weight
+    totals = v.sum(axis=1, keepdims=True)
+    if (v < 0).any() or (totals <= 0).any():
+        raise ValueError("teleport weights must be non-negative and not all zero")
+    v /= totals
+
+    x = v.copy()
+    active = np.arange(len(names))
+    for _ in range(max_iterations):
+        if not len(active):
+            break
+        current = x[active]
+        dangling = current[:, graph.dangling].sum(axis=1, keepdims=True)
+        followed = graph.matmat(current) + dangling * v[active]
+        new = damping_factor * followed + (1 - damping_factor) * v[active]
+        residuals = np.abs(new - current).sum(axis=1)
+        x[active] = new
+        active = active[residuals >= tolerance]
+
+    return {name: graph.ranks(x[row]) for row, name in enumerate(names)}
+
+
+class EdgeFile():
+    """
+    Links of a corpus in a binary file, memory-mapped so that graphs
+    larger than memory can be ranked.
+
+    After a header (magic, number of pages, number of links, size of the
+    page names) the file holds, in page order:
+      indptr      int64 x (N + 1)  links into each page start here
+      out_degree  uint32 x N       number of links on each page
+      sources     uint32 x links   page each link comes from, sorted by
+                                   the page it points to
+      names       page names, UTF-8, one per line
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            magic, n, m, size = EDGES_HEADER.unpack(f.read(EDGES_HEADER.size))
+            if magic != EDGES_MAGIC:
+                raise ValueError("not a pagerank edge file")
+            f.seek(EDGES_HEADER.size + 8 * (n + 1) + 4 * n + 4 * m)
+            self.pages = f.read(size).decode().split("\n") if n else []
+        offset = EDGES_HEADER.size
+        self.indptr = np.memmap(path, np.int64, "r", offset, (n + 1,))
+        offset += 8 * (n + 1)
+        self.out_degree = np.memmap(path, np.uint32, "r", offset, (n,)) if n else np.zeros(0, np.uint32)
+        offset += 4 * n
+        self.sources = np.memmap(path, np.uint32, "r", offset, (m,)) if m else np.zeros(0, np.uint32)
+
+    def __len__(self):
+        return len(self.pages)
+
+    @classmethod
+    def build(cls, directory, path, workers=None, chunk_edges=CHUNK_EDGES):
+        """
+        Crawl `directory` like `stream_crawl` and write its links to the
+        edge file at `path`, never holding more than `chunk_edges` links
+        in memory. Links are first appended to a temporary file as they
+        are found, then counted and scattered to their place by
+        destination (a counting sort).
+        """
+        pages = sorted(
+            entry.name for entry in os.scandir(directory)
+            if entry.name.endswith(".html") and entry.is_file()
+        )
+        index = {page: i for i, page in enumerate(pages)}
+        n = len(pages)
+        out_degree = np.zeros(n, dtype=np.uint32)
+        in_degree = np.zeros(n, dtype=np.int64)
+
+        with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path))) as raw:
+            # Append (source, destination) pairs in crawl order
+            pending = []
+            with ThreadPoolExecutor(workers) as executor:
+                found = executor.map(
+                    lambda page: read_links(os.path.join(directory, page)), pages)
+                for source, links in enumerate(found):
+                    targets = [index[link] for link in links
+                               if link in index and index[link] != source]
+                    out_degree[source] = len(targets)
+                    pending.extend((source, target) for target in targets)
+                    if len(pending) >= chunk_edges:
+                        write_pairs(raw, pending, in_degree)
+                        pending = []
+            write_pairs(raw, pending, in_degree)
+            m = int(in_degree.sum())
+
+            names = "\n".join(pages).encode()
+            indptr = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(in_degree, out=indptr[1:])
+            with open(path, "wb") as f:
+                f.write(EDGES_HEADER.pack(EDGES_MAGIC, n, m, len(names)))
+                f.write(indptr.tobytes())
+                f.write(out_degree.tobytes())
+                f.truncate(f.tell() + 4 * m)
+                f.seek(0, os.SEEK_END)
+                f.write(names)
+
+            if m:
+                offset = EDGES_HEADER.size + 8 * (n + 1) + 4 * n
+                sources = np.memmap(path, np.uint32, "r+", offset, (m,))
+                cursor = indptr[:-1].copy()
+                raw.seek(0)
+                while len(pairs := np.fromfile(raw, np.uint32, 2 * chunk_edges)):
+                    pairs = pairs.reshape(-1, 2)
+                    order = np.argsort(pairs[:, 1], kind="stable")
+                    source, target = pairs[order, 0], pairs[order, 1]
+                    starts = np.flatnonzero(np.r_[True, target[1:] != target[:-1]])
+                    counts = np.diff(np.r_[starts, len(target)])
+                    within = np.arange(len(target)) - np.repeat(starts, counts)
+                    sources[cursor[target] + within] = source
+                    cursor[target[starts]] += counts
+                sources.flush()
+                del sources
+        return cls(path)
+
+
+def write_pairs(f, pairs, in_degree):
+    """
+    Append (source, destination) `pairs` to file `f` as uint32 and
+    count them in `in_degree`.
+    """
+    if not pairs:
+        return
+    pairs = np.array(pairs, dtype=np.uint32)
+    pairs.tofile(f)
+    in_degree += np.bincount(pairs[:, 1], minlength=len(in_degree))
+
+
+def stream_pagerank(edges, damping_factor, tolerance=TOLERANCE,
+                    max_iterations=MAX_ITERATIONS, chunk_edges=CHUNK_EDGES, report=None):
+    """
+    Return PageRank values for each page of the `EdgeFile` `edges` by
+    power iteration, reading the links from disk `chunk_edges` at a
+    time in every step so that only the rank vectors are kept in memory.
+    Stops and reports like `solve_pagerank`.
+    """
+    n = len(edges)
+    if n == 0:
+        return dict()
+    indptr = np.asarray(edges.indptr)
+    out_degree = np.asarray(edges.out_degree, dtype=np.int64)
+    dangling = out_degree == 0
+    share = np.zeros(n)
+
+    # Pages at which each chunk of links starts, a whole page per chunk
+    bounds = np.unique(np.r_[
+        np.searchsorted(indptr, np.arange(0, indptr[-1], chunk_edges), side="right") - 1, n])
+
+    x = np.full(n, 1 / n)
+    begin = time.perf_counter()
+    for iteration in range(1, max_iterations + 1):
+        np.divide(x, out_degree, out=share, where=~dangling)
+        followed = np.full(n, x[dangling].sum() / n)
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            start, end = indptr[first], indptr[last]
+            if start == end:
                 continue
-            if page in links:
-                page_refs[page].append(ref)
-
-    while page_refs:
-        for page, refs in page_refs.copy().items():
-            prev = page_ranks[page]
-            new = (1-damping_factor) / len(corpus) + damping_factor * sum([page_ranks[x] / len(corpus[x]) for x in refs])
-            page_ranks[page] = new
-            if abs(new - prev) < min_dif:
-                page_refs.__delitem__(page)
-
-    return page_ranks
+            contributions = share[edges.sources[start:end]]
+            starts = indptr[first:last] - start
+            rows = np.flatnonzero(starts < indptr[first + 1:last + 1] - start)
+            followed[first + rows] += np.add.reduceat(contributions, starts[rows])
+        new = damping_factor * followed + (1 - damping_factor) / n
+        residual = np.abs(new - x).sum()
+        x = new
+        if report is not None:
+            report(iteration, residual, time.perf_counter() - begin)
+        if residual < tolerance:
+            break
+    return {page: float(x[i]) for i, page in enumerate(edges.pages)}
+
+
+def update_pagerank(corpus, ranks, changes, damping_factor, tolerance=TOLERANCE,
+                    max_iterations=MAX_ITERATIONS):
+    """
+    Return PageRank values for `corpus` (a corpus dictionary or a
+    `LinkGraph`) after the links of some pages changed, given `ranks`,
+    the PageRank values from before the change, and `changes`, a
+    dictionary mapping every page whose links changed to the set of
+    pages it linked to before.
+
+    Rather than iterating from scratch, only the rank that the changed
+    links redirect is propagated: each page keeps a residual (the rank
+    it is still owed), and in every round the pages owed more than
+    tolerance / N push it on along their links, until no page is.
+    Pages far from the change are never touched.
+
+    Rank pushed by pages without links is owed to every page alike, so
+    it is kept as a single `spread`. Scaling all ranks by 1 + c, with
+    c = spread * N / (1 - damping_factor), pays it off and leaves only
+    c * spread owed to each page, so it is settled that way while c is
+    small. A larger spread (a page with much rank lost or gained its
+    last link) is added to every page's residual and pushed instead.
+
+    Warns with a RuntimeWarning if the residuals are still above the
+    tolerance after `max_iterations` rounds.
+
+    If pages were added or removed, power iteration is run instead,
+    starting from `ranks`.
+    """
+    graph = corpus if isinstance(corpus, LinkGraph) else LinkGraph.from_corpus(corpus)
+    n = len(graph)
+    if ranks.keys() != graph.index.keys() or damping_factor >= 1:
+        return sparse_pagerank(graph, damping_factor, tolerance, max_iterations, start=ranks)
+
+    x = np.array([ranks[page] for page in graph.pages], dtype=float)
+    residual = np.zeros(n)
+    spread = 0.0
+
+    # Move the rank each changed page gives from its old links to its new ones
+    for page, old in changes.items():
+        i = graph.index[page]
+        old = [graph.index[link] for link in old if link in graph.index and link != page]
+        new = graph.out_indices[graph.out_indptr[i]:graph.out_indptr[i + 1]]
+        for links, amount in ((old, -damping_factor * x[i]), (new, damping_factor * x[i])):
+            if len(links):
+                np.add.at(residual, links, amount / len(links))
+            else:
+                spread += amount / n
+
+    threshold = tolerance / n
+    for _ in range(max_iterations):
+        active = np.flatnonzero(np.abs(residual) > threshold)
+        if not len(active):
+            if abs(spread) <= threshold:
+                break
+            c = spread * n / (1 - damping_factor)
+            if abs(c) < 0.5:
+                x *= 1 + c
+                residual *= 1 + c
+                spread *= c
+            else:
+                residual += spread
+                spread = 0.0
+            continue
+        pushed = residual[active]
+        x[active] += pushed
+        residual[active] = 0
+
+        # Rank pushed by pages without links reaches every page
+        degree = graph.out_degree[active]
+        dangling = degree == 0
+        if dangling.any():
+            spread += damping_factor * pushed[dangling].sum() / n
+            active, pushed, degree = active[~dangling], pushed[~dangling], degree[~dangling]
+
+        # Positions of the links of every active page in out_indices
+        ends = np.cumsum(degree)
+        edges = np.arange(ends[-1] if len(ends) else 0) + np.repeat(
+            graph.out_indptr[active] - ends + degree, degree)
+        residual += np.bincount(graph.out_indices[edges],
+                                weights=np.repeat(damping_factor * pushed / degree, degree),
+                                minlength=n)
+    else:
+        warnings.warn(f"update_pagerank did not converge in {max_iterations} rounds",
+                      RuntimeWarning)
+
+    return graph.ranks(x)
 
 
 if __name__ == "__main__":
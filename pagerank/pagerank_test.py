@@ -6,11 +6,30 @@ Make sure that this file is in the same directory as pagerank.py!
 'Why do we fall sir? So that we can learn to pick ourselves up.'
                                         - Batman Begins (2005)
 """
+import os
 import random as rd
+import shutil
 
 import pytest as pt
 
-from pagerank import DAMPING, crawl, iterate_pagerank, sample_pagerank
+from pagerank import (
+    DAMPING,
+    METHODS,
+    EdgeFile,
+    batch_sample_pagerank,
+    crawl,
+    index_crawl,
+    iterate_pagerank,
+    parallel_sample_pagerank,
+    personalized_pagerank,
+    sample_pagerank,
+    solve_pagerank,
+    sparse_pagerank,
+    stream_crawl,
+    stream_pagerank,
+    table_sample_pagerank,
+    update_pagerank,
+)
 
 TOLERANCE = 1e-3  # Error tolerance = ±0.001 when comparing sample and iterate results
 SAMPLES = 10 ** 6  # More samples => better result
@@ -22,6 +41,27 @@ def test_crawl0():
     assert len(corpus0) == 4
 
 
+@pt.mark.parametrize("chunk_size", [1, 5, 1 << 16])
+@pt.mark.parametrize("directory", ["corpus0", "corpus1", "corpus2"])
+def test_stream_crawl(directory, chunk_size):
+    assert stream_crawl(directory, workers=4, chunk_size=chunk_size) == crawl(directory)
+
+
+def test_index_crawl(tmp_path):
+    directory = tmp_path / "corpus"
+    shutil.copytree("corpus2", directory)
+    assert index_crawl(directory) == crawl(directory)
+
+    (directory / "new.html").write_text('<a href="ai.html">AI</a>')
+    with open(directory / "python.html", "a") as f:
+        f.write('<a href="new.html">New</a>')
+    assert index_crawl(directory) == crawl(directory)
+    assert "new.html" in index_crawl(directory)["python.html"]
+
+    os.remove(directory / "new.html")
+    assert index_crawl(directory) == crawl(directory)
+
+
 def test_iterate0():
     expected = {"1.html": 0.2202, "2.html": 0.4289, "3.html": 0.2202, "4.html": 0.1307}
     iterate = iterate_pagerank(corpus0, damping_factor=DAMPING)
@@ -33,6 +73,162 @@ def test_sample_vs_iterate(execution_number):
     return run_sample_vs_iterate()
 
 
+def test_sparse0():
+    expected = {"1.html": 0.2202, "2.html": 0.4289, "3.html": 0.2202, "4.html": 0.1307}
+    sparse = sparse_pagerank(corpus0, damping_factor=DAMPING)
+    checksum(sparse)
+    return compare(sparse, expected)
+
+
+@pt.mark.parametrize("execution_number", range(3))
+def test_sample_vs_sparse(execution_number):
+    corpus, _ = generate_random_data()
+    sample = sample_pagerank(corpus, damping_factor=DAMPING, n=SAMPLES)
+    sparse = sparse_pagerank(corpus, damping_factor=DAMPING)
+    checksum(sparse)
+    return compare(sample, sparse)
+
+
+@pt.mark.parametrize("execution_number", range(3))
+def test_table_sample_vs_sparse(execution_number):
+    corpus, _ = generate_random_data()
+    sample = table_sample_pagerank(corpus, damping_factor=DAMPING, n=SAMPLES)
+    sparse = sparse_pagerank(corpus, damping_factor=DAMPING)
+    checksum(sample)
+    return compare(sample, sparse)
+
+
+def test_table_sample_seeded():
+    first = table_sample_pagerank(corpus0, DAMPING, 1000, seed=1)
+    second = table_sample_pagerank(corpus0, DAMPING, 1000, seed=1)
+    assert first == second
+
+
+@pt.mark.parametrize("execution_number", range(3))
+def test_batch_sample_vs_sparse(execution_number):
+    corpus, _ = generate_random_data()
+    sample = batch_sample_pagerank(corpus, damping_factor=DAMPING, n=SAMPLES)
+    sparse = sparse_pagerank(corpus, damping_factor=DAMPING)
+    checksum(sample)
+    return compare(sample, sparse)
+
+
+def test_batch_sample_seeded():
+    first = batch_sample_pagerank(corpus0, DAMPING, 10000, surfers=100, seed=1)
+    second = batch_sample_pagerank(corpus0, DAMPING, 10000, surfers=100, seed=1)
+    assert first == second
+
+
+def test_parallel_sample_vs_sparse():
+    corpus, _ = generate_random_data()
+    sample = parallel_sample_pagerank(corpus, damping_factor=DAMPING, n=SAMPLES, workers=4)
+    sparse = sparse_pagerank(corpus, damping_factor=DAMPING)
+    checksum(sample)
+    return compare(sample, sparse)
+
+
+def test_parallel_sample_seeded():
+    first = parallel_sample_pagerank(corpus0, DAMPING, 10000, workers=2, seed=1)
+    second = parallel_sample_pagerank(corpus0, DAMPING, 10000, workers=2, seed=1)
+    assert first == second
+
+
+@pt.mark.parametrize("execution_number", range(5))
+def test_update_vs_sparse(execution_number):
+    corpus, page = generate_random_data()
+    ranks = sparse_pagerank(corpus, damping_factor=DAMPING)
+    changes = {page: corpus[page]}
+    corpus[page] = set(rd.choices(list(corpus), k=rd.randint(0, len(corpus)))) - {page}
+    update = update_pagerank(corpus, ranks, changes, damping_factor=DAMPING)
+    checksum(update)
+    return compare(update, sparse_pagerank(corpus, damping_factor=DAMPING))
+
+
+def test_update_hub_dangling():
+    # a hub with almost half the rank gains links, then loses them again
+    corpus = {f"{i}.html": {"hub.html"} for i in range(50)}
+    corpus["hub.html"] = set()
+    ranks = sparse_pagerank(corpus, damping_factor=DAMPING)
+    linked = dict(corpus, **{"hub.html": {"1.html", "2.html"}})
+    update = update_pagerank(linked, ranks, {"hub.html": set()}, damping_factor=DAMPING)
+    checksum(update)
+    compare(update, sparse_pagerank(linked, damping_factor=DAMPING))
+
+    update = update_pagerank(corpus, update, {"hub.html": {"1.html", "2.html"}},
+                             damping_factor=DAMPING)
+    checksum(update)
+    return compare(update, ranks)
+
+
+def test_update_new_page():
+    ranks = sparse_pagerank(corpus0, damping_factor=DAMPING)
+    corpus = dict(corpus0, **{"5.html": {"1.html"}})
+    update = update_pagerank(corpus, ranks, {"5.html": set()}, damping_factor=DAMPING)
+    return compare(update, sparse_pagerank(corpus, damping_factor=DAMPING))
+
+
+@pt.mark.parametrize("method", METHODS)
+def test_solve0(method):
+    expected = {"1.html": 0.2202, "2.html": 0.4289, "3.html": 0.2202, "4.html": 0.1307}
+    ranks = solve_pagerank(corpus0, damping_factor=DAMPING, method=method)
+    checksum(ranks)
+    return compare(ranks, expected)
+
+
+@pt.mark.parametrize("method", METHODS)
+def test_solve_vs_sparse(method):
+    corpus, _ = generate_random_data()
+    ranks = solve_pagerank(corpus, damping_factor=DAMPING, method=method)
+    checksum(ranks)
+    return compare(ranks, sparse_pagerank(corpus, damping_factor=DAMPING))
+
+
+def test_iterate_empty():
+    assert iterate_pagerank({}, damping_factor=DAMPING) == {}
+
+
+def test_solve_report():
+    residuals = []
+    solve_pagerank(corpus0, DAMPING, tolerance=1e-8,
+                   report=lambda iteration, residual, seconds: residuals.append(residual))
+    assert residuals[-1] < 1e-8
+    assert all(residual >= 1e-8 for residual in residuals[:-1])
+
+
+def test_personalized_uniform():
+    corpus, _ = generate_random_data()
+    ranks = personalized_pagerank(corpus, DAMPING, {"all": dict.fromkeys(corpus, 1)})
+    return compare(ranks["all"], sparse_pagerank(corpus, damping_factor=DAMPING))
+
+
+def test_personalized0():
+    teleports = {"1": {"1.html": 1}, "3": {"3.html": 1}, "both": {"1.html": 1, "3.html": 1}}
+    ranks = personalized_pagerank(corpus0, DAMPING, teleports)
+    for name, teleport in teleports.items():
+        checksum(ranks[name])
+        # each ranking is its own fixed point
+        for page in corpus0:
+            received = sum(ranks[name][other] / len(links)
+                           for other, links in corpus0.items() if page in links)
+            jump = teleport.get(page, 0) / sum(teleport.values())
+            expected = DAMPING * received + (1 - DAMPING) * jump
+            assert ranks[name][page] == pt.approx(expected, abs=TOLERANCE)
+    assert ranks["1"]["1.html"] > ranks["3"]["1.html"]
+
+
+def test_personalized_invalid():
+    with pt.raises(ValueError):
+        personalized_pagerank(corpus0, DAMPING, {"none": {}})
+
+
+@pt.mark.parametrize("directory", ["corpus0", "corpus1", "corpus2"])
+def test_stream_pagerank(directory, tmp_path):
+    edges = EdgeFile.build(directory, tmp_path / "pagerank.edges", chunk_edges=3)
+    ranks = stream_pagerank(edges, DAMPING, chunk_edges=2)
+    checksum(ranks)
+    return compare(ranks, sparse_pagerank(crawl(directory), damping_factor=DAMPING))
+
+
 # helper function
 
 